@@ -5,26 +5,39 @@ Arena hero selection logic.
 from __future__ import annotations
 
 import pickle
-from base64 import b85decode
-from dataclasses import dataclass
-from functools import total_ordering
-from itertools import combinations, count, product
+import random
+import tracemalloc
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass, field
+from functools import partial, total_ordering
+from itertools import combinations, count, permutations, product, repeat
+from math import ceil, comb
 from pathlib import Path
-from typing import Any, Callable, Dict, Iterable, List, MutableMapping, Optional, TypeVar
+from resource import RUSAGE_SELF, getrusage
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple, Type, TypeVar
+from zlib import crc32
 
 import click
 import numpy
 from loguru import logger
 from numpy import arange, ndarray, vstack
-from numpy.random import choice, permutation, randint
+from numpy.random import RandomState
+from pandas import DataFrame, concat
 
 import bestmobabot.logging_
 from bestmobabot import constants
 from bestmobabot.constants import TEAM_SIZE
 from bestmobabot.database import Database
 from bestmobabot.dataclasses_ import ArenaEnemy, BaseArenaEnemy, GrandArenaEnemy, Hero, Loggable
-from bestmobabot.itertools_ import CountDown, secretary_max, slices
-from bestmobabot.model import Model
+from bestmobabot.enums import ArenaEngine
+from bestmobabot.helpers import WorkerPool, get_worker_state, naive_select_attackers, start_workers
+from bestmobabot.itertools_ import secretary_max, slices
+from bestmobabot.model import Model, load_model
+from bestmobabot.settings import ArenaSettings
 
 T = TypeVar('T')
 
@@ -32,6 +45,54 @@ T = TypeVar('T')
 # Universal arena solver.
 # ----------------------------------------------------------------------------------------------------------------------
 
+@dataclass
+class SolverStats:
+    n_enemies: int = 0  # number of solved enemies
+    n_skipped: int = 0  # number of enemies skipped after screening or dropped by halving
+    time: float = 0.0  # seconds spent solving
+    screening_time: float = 0.0  # seconds spent screening
+    n_generations: int = 0  # number of evolved generations
+    n_solutions: int = 0  # number of evaluated solutions
+    n_rows: int = 0  # number of feature rows scored by the model
+    n_timeouts: int = 0  # number of enemies which ran out of time
+    n_best_rows: int = 0  # number of feature rows scored until the best solutions have been found
+    timings: Dict[str, float] = field(default_factory=dict)  # seconds spent in each phase, if profiled
+
+    @property
+    def saved_time(self) -> float:
+        """
+        Estimated time saved by skipping the enemies.
+        """
+        if not self.n_enemies:
+            return -self.screening_time
+        return self.n_skipped * self.time / self.n_enemies - self.screening_time
+
+    def __iadd__(self, other: SolverStats) -> SolverStats:
+        self.n_enemies += other.n_enemies
+        self.n_skipped += other.n_skipped
+        self.time += other.time
+        self.screening_time += other.screening_time
+        self.n_generations += other.n_generations
+        self.n_solutions += other.n_solutions
+        self.n_rows += other.n_rows
+        self.n_timeouts += other.n_timeouts
+        self.n_best_rows += other.n_best_rows
+        for phase, seconds in other.timings.items():
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+        return self
+
+    def __str__(self) -> str:
+        return ', '.join([
+            f'{self.n_enemies} enemies in {self.time:.1f} s',
+            f'{self.n_skipped} skipped ({self.saved_time:.1f} s saved)',
+            f'{self.n_generations} generations',
+            f'{self.n_solutions} solutions',
+            f'{self.n_rows} rows ({self.n_best_rows} until the best)',
+            f'{self.n_timeouts} timeouts',
+            *(f'{phase}: {1000.0 * seconds:.1f} ms' for phase, seconds in self.timings.items()),
+        ])
+
+
 @dataclass
 @total_ordering
 class ArenaSolution(Loggable):
@@ -39,11 +100,13 @@ class ArenaSolution(Loggable):
     attackers: List[List[Hero]]  # player's attacker teams
     probability: float  # arena win probability
     probabilities: List[float]  # individual battle win probabilities
+    stats: SolverStats = field(default_factory=SolverStats, compare=False)  # how the solution has been found
 
     @property
     def plain_text(self) -> Iterable[str]:
         yield 'Solution:'
         yield str(self)
+        yield f'Stats: {self.stats}'
         for i, (defenders, attackers) in enumerate(zip(self.enemy.teams, self.attackers), start=1):
             yield f'Defenders #{i}'
             for hero in sorted(defenders, reverse=True):
@@ -75,6 +138,29 @@ class ArenaSolution(Loggable):
         )
 
 
+@dataclass
+class Evolution:
+    """
+    Genetic algorithm state of a single enemy, which allows to continue the evolution later on.
+    """
+    enemy: BaseArenaEnemy
+    random_state: RandomState
+    solutions: ndarray  # survivors
+    ys: ndarray  # individual battle probabilities of the survivors
+    memo: TeamMemo
+    solution: ArenaSolution  # the best solution so far
+    stats: SolverStats
+    n_generations_left: int  # before the evolution gets finished without an improvement
+    deadline: Optional[float] = None
+    is_finished: bool = False
+    island: int = 0
+    worker: Optional[int] = None  # worker process which keeps the memo once the evolution gets there
+
+    @property
+    def memo_key(self) -> Tuple[str, int]:
+        return self.enemy.user_id, self.island
+
+
 class ArenaSolver:
     """
     Generic arena solver for both normal arena and grand arena.
@@ -96,8 +182,22 @@ class ArenaSolver:
         early_stop: float,
         get_enemies: Callable[[], List[BaseArenaEnemy]],
         friendly_clans: Iterable[str],
-        reduce_probabilities: Callable[..., ndarray],
+        reduce_probabilities: Callable[[ndarray], ndarray],
         callback: Callable[[int], Any],
+        n_workers: int = 1,
+        seed: Optional[int] = None,
+        prefetch: bool = False,
+        exhaustive_max_teams: int = 0,
+        user_id: Optional[str] = None,
+        profile: bool = False,
+        enemy_time_limit: Optional[float] = None,
+        page_time_limit: Optional[float] = None,
+        screening_margin: Optional[float] = None,
+        halving_generations: Optional[int] = None,
+        n_islands: int = 1,
+        migration_interval: int = 10,
+        engine: ArenaEngine = ArenaEngine.GENETIC,
+        assign_teams: bool = False,
     ):
         """
         :param model: prediction model.
@@ -111,8 +211,25 @@ class ArenaSolver:
         :param early_stop: minimal probability to attack the enemy immediately.
         :param get_enemies: callable to fetch an enemy page.
         :param friendly_clans: friendly clan IDs or titles.
-        :param reduce_probabilities: callable to combine probabilities from multiple battles into a final one.
+        :param reduce_probabilities: callable to combine probabilities from multiple battles into a final one,
+                                     it receives individual battle probabilities, one row per battle.
         :param callback: callable which receives current arena enemies page.
+        :param n_workers: number of worker processes to solve enemies of the same page in parallel.
+        :param seed: random seed, each enemy gets its own seed derived from it.
+        :param prefetch: fetch the next enemy page in background while solving the current one.
+        :param exhaustive_max_teams: score all possible teams instead of evolving if there are not more of them.
+        :param user_id: current user ID, if set the final population is stored to warm-start the next run.
+        :param profile: measure time spent in each solver phase, and store the run stats if `user_id` is set.
+        :param enemy_time_limit: time budget in seconds per enemy, the time left over goes to the next enemies.
+        :param page_time_limit: time budget in seconds per enemy page.
+        :param screening_margin: if set, quickly screen the enemies first and skip the ones which won't be selected
+                                 even if the solving improves their screening probability by the margin.
+        :param halving_generations: if set, evolve all the page enemies for the number of generations,
+                                    then keep evolving the better half only with the doubled number, and so on.
+        :param n_islands: number of populations evolved against each enemy, in parallel if the pool is running.
+        :param migration_interval: number of generations between migrations of the best solutions across islands.
+        :param engine: search strategy which evolves the population.
+        :param assign_teams: score each attacker team against each defender team, and assign them optimally.
         """
 
         self.db = db
@@ -129,6 +246,23 @@ class ArenaSolver:
         self.friendly_clans = set(friendly_clans)
         self.reduce_probabilities = reduce_probabilities
         self.callback = callback
+        self.n_workers = n_workers
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.prefetch = prefetch
+        self.exhaustive_max_teams = exhaustive_max_teams
+        self.user_id = user_id
+        self.profile = profile
+        self.enemy_time_limit = enemy_time_limit
+        self.page_time_limit = page_time_limit
+        self.screening_margin = screening_margin
+        self.halving_generations = halving_generations
+        self.n_islands = n_islands
+        self.migration_interval = migration_interval
+        self.engine = engine
+        self.assign_teams = assign_teams
+
+        # Worker process pool, it's only alive while solving.
+        self.pool: Optional[WorkerPool] = None
 
         # If the same enemy is encountered again, we will use the earlier solution.
         self.cache: Dict[str, ArenaSolution] = {}
@@ -136,27 +270,116 @@ class ArenaSolver:
         # We keep solutions in an attribute because we want to retry the best solutions across different enemies.
         self.solutions = numpy.array([[]])
 
+        # Stats of the current run, summed up over the solved enemies.
+        self.stats = SolverStats()
+
     def solve(self) -> ArenaSolution:
         self.initialize()
-        return secretary_max(self.yield_solutions(), self.max_iterations, early_stop=self.early_stop)
+        with self.start_pool():
+            solution = self.select_solution()
+        self.store_solutions()
+        self.store_stats()
+        return solution
+
+    @contextmanager
+    def start_pool(self) -> Iterator[None]:
+        """
+        Keep the worker processes running while in the context, unless there's the only worker.
+        """
+        with start_workers(self.n_workers, self) as self.pool:
+            try:
+                yield
+            finally:
+                self.pool = None
+
+    def select_solution(self) -> ArenaSolution:
+        # Closing the generator explicitly drops the prefetched page as soon as the enemy is selected.
+        with closing(self.yield_solutions()) as solutions:
+            return secretary_max(solutions, self.max_iterations, early_stop=self.early_stop)
 
     def initialize(self) -> ArenaSolver:
         logger.debug('Generating initial solutions…')
-        self.solutions = vstack([permutation(len(self.heroes)) for _ in range(self.n_keep_solutions)])
+        self.stats = SolverStats()
+        random_state = RandomState(self.seed)
+        stored_solutions = self.load_solutions(random_state)[:self.n_keep_solutions]
+        self.solutions = vstack([
+            *stored_solutions,
+            *(random_state.permutation(len(self.heroes)) for _ in range(self.n_keep_solutions - len(stored_solutions))),
+        ]).astype(self.hero_dtype)
         return self
 
+    @property
+    def hero_dtype(self) -> numpy.dtype:
+        """
+        The smallest unsigned integer type for hero indices. It saves memory bandwidth in the hot loop.
+        """
+        return numpy.min_scalar_type(max(len(self.heroes) - 1, 0))
+
+    @property
+    def solutions_key(self) -> str:
+        """
+        Database key to store the final population.
+        """
+        return f'arena:{self.n_required_teams}:{self.user_id}:solutions'
+
+    def load_solutions(self, random_state: RandomState) -> List[ndarray]:
+        """
+        Load the population stored by the previous run. Heroes are stored by their IDs, thus the solutions get mapped
+        onto the current heroes. New heroes get appended to the unused ones.
+        """
+        if self.user_id is None or not (stored_solutions := self.db.get(self.solutions_key)):
+            return []
+        hero_indices = {hero.id: i for i, hero in enumerate(self.heroes)}
+        solutions = []
+        for hero_ids in stored_solutions:
+            solution = [hero_indices[hero_id] for hero_id in hero_ids if hero_id in hero_indices]
+            new_indices = numpy.setdiff1d(arange(len(self.heroes)), solution)
+            solutions.append(numpy.concatenate((solution, random_state.permutation(new_indices))).astype(int))
+        logger.debug('Loaded {} stored solutions.', len(solutions))
+        return solutions
+
+    def store_solutions(self):
+        if self.user_id is not None:
+            self.db[self.solutions_key] = [[self.heroes[i].id for i in solution] for solution in self.solutions]
+
+    def store_stats(self):
+        logger.info('Run stats: {}.', self.stats)
+        if self.profile and self.user_id is not None:
+            self.db[f'arena:{self.n_required_teams}:{self.user_id}:stats'] = asdict(self.stats)
+
     def yield_solutions(self) -> Iterable[ArenaSolution]:
         """
         Yield the best solution from each `get_enemies` call.
         """
-        for n_page in count(1):
-            logger.debug('Fetching enemies…')
-            self.callback(n_page)
-            if enemies := list(self.filter_enemies(self.get_enemies())):
-                yield max(self.solve_enemy_cached(enemy) for enemy in enemies)
+        for enemies in self.yield_enemies():
+            if enemies := list(self.filter_enemies(enemies)):
+                yield self.solve_page(enemies)
             else:
                 logger.debug('All enemies are filtered out on the current page.')
 
+    def yield_enemies(self) -> Iterable[List[BaseArenaEnemy]]:
+        """
+        Yield enemy pages. With prefetching on, the next page is fetched while the current one is being solved.
+        """
+        if not self.prefetch:
+            for n_page in count(1):
+                self.callback(n_page)
+                yield self.fetch_enemies()
+            return
+        # Leaving the executor waits for the pending request, so that it won't interfere with the following API calls.
+        with ThreadPoolExecutor(1, thread_name_prefix='prefetch') as executor:
+            future = executor.submit(self.fetch_enemies)
+            for n_page in count(1):
+                enemies = future.result() if future is not None else self.fetch_enemies()
+                # There's no point to prefetch the page which can't be used anyway.
+                future = executor.submit(self.fetch_enemies) if n_page < self.max_iterations else None
+                self.callback(n_page)
+                yield enemies
+
+    def fetch_enemies(self) -> List[BaseArenaEnemy]:
+        logger.debug('Fetching enemies…')
+        return self.get_enemies()
+
     def filter_enemies(self, enemies: Iterable[BaseArenaEnemy]) -> Iterable[BaseArenaEnemy]:
         """
         Filter out "bad" enemies and enemies from the friendly clans.
@@ -197,203 +420,1210 @@ class ArenaSolver:
         self.db[f'{enemy_key}:teams'] = [[hero.dict() for hero in team] for team in enemy.teams]
         self.db[f'{enemy_key}:place'] = enemy.place
 
-    def solve_enemy_cached(self, enemy: BaseArenaEnemy) -> ArenaSolution:
+    def solve_page(self, enemies: List[BaseArenaEnemy]) -> ArenaSolution:
         """
-        Makes use of the solution cache for repeated enemies.
+        Solve the page enemies, in parallel if the pool is running, and return the best solution.
+        Makes use of the solution cache for repeated enemies. Enemies skipped after screening or dropped by halving
+        are not cached, so that they would get solved if they show up again.
         """
-        solution = self.cache.get(enemy.user_id)
-        if not solution:
-            solution = self.solve_enemy(enemy)
-            self.cache[enemy.user_id] = solution
+        # Every enemy starts off the same population, this way the results don't depend on the execution mode.
+        solutions = self.solutions
+        new_enemies = list({enemy.user_id: enemy for enemy in enemies if enemy.user_id not in self.cache}.values())
+        if self.screening_margin is not None:
+            new_enemies = self.screen_enemies(new_enemies)
+        is_halving = self.halving_generations is not None and not any(map(self.is_exhaustive, new_enemies))
+        # Otherwise, the pool is busy with the islands of each enemy, and the enemies are solved one by one.
+        is_parallel = self.pool is not None and (is_halving or self.n_islands == 1)
+        deadlines = self.make_deadlines(len(new_enemies), self.n_workers if is_parallel else 1)
+        if is_halving:
+            results = self.solve_halving(new_enemies, solutions, deadlines[-1] if deadlines else None)
+        elif is_parallel:
+            results = self.pool.map(solve_enemy_in_worker, new_enemies, repeat(solutions), deadlines)
         else:
-            logger.debug('Cache hit: #{}.', enemy.user_id)
-        logger.success('{}', solution)
+            results = (
+                self.solve_enemy_from(enemy, solutions, deadline)
+                for enemy, deadline in zip(new_enemies, deadlines)
+            )
+
+        populations: Dict[str, ndarray] = {}
+        for enemy, (solution, population) in zip(new_enemies, results):
+            self.stats += solution.stats
+            if population is None:
+                continue  # dropped by halving
+            self.cache[enemy.user_id] = solution
+            populations[enemy.user_id] = population
+        page_solutions: List[ArenaSolution] = []
+        for enemy in enemies:
+            if enemy.user_id not in self.cache:
+                continue  # skipped after screening or dropped by halving
+            if enemy.user_id not in populations:
+                logger.debug('Cache hit: #{}.', enemy.user_id)
+            logger.success('{}', self.cache[enemy.user_id])
+            page_solutions.append(self.cache[enemy.user_id])
+
+        # Continue with the population which has been evolved against the best enemy.
+        # Neither screening nor halving drops all the new enemies, thus there's at least one solved enemy on the page.
+        solution = max(page_solutions)
+        self.solutions = populations.get(solution.enemy.user_id, solutions)
         return solution
 
-    def solve_enemy(self, enemy: BaseArenaEnemy) -> ArenaSolution:
+    def screen_enemies(self, enemies: List[BaseArenaEnemy]) -> List[BaseArenaEnemy]:
+        """
+        Screen the enemies and return the ones which are worth solving.
+        The best screened enemy is always worth solving, so that the page solution is an optimized one.
+        """
+        screened = [self.screen_enemy(enemy) for enemy in enemies]
+        for solution in screened:
+            self.stats += solution.stats
+        if not screened:
+            return []
+
+        # Solving would at least keep the screening probability, thus the best screened enemy must be solved.
+        # Others are compared against the earlier pages as well, but there is also no need to look for better enemies
+        # than the early stop threshold.
+        best_screened = max(screened)
+        bar = min(max(solution.probability for solution in [*screened, *self.cache.values()]), self.early_stop)
+
+        worth_solving = []
+        for solution in screened:
+            if solution is best_screened or solution.probability + self.screening_margin >= bar:
+                worth_solving.append(solution.enemy)
+                continue
+            logger.debug('Skipped after screening: {}.', solution)
+            self.stats.n_skipped += 1
+        return worth_solving
+
+    def screen_enemy(self, enemy: BaseArenaEnemy) -> ArenaSolution:
+        """
+        Score the current population along with the most powerful heroes in a single batch.
+        """
+        start_time = perf_counter()
+        n_teams = len(enemy.teams)
+        team_selectors = slices(n_teams, TEAM_SIZE)
+        hero_features, defenders_features = self.make_enemy_features(enemy)
+
+        solutions = vstack([self.make_heuristic_solution(), self.solutions])
+        memo = TeamMemo(len(solutions) * n_teams)
+        ys = numpy.empty((n_teams, len(solutions)))
+        x = numpy.empty((n_teams * len(solutions), hero_features.shape[1]))
+        x_heroes = numpy.empty((len(solutions), hero_features.shape[1]))
+        self.predict_battles(
+            solutions, hero_features, defenders_features, team_selectors, memo, PhaseTimer(None),
+            out=ys, x=x, x_heroes=x_heroes,
+        )
+        y_reduced = self.reduce_probabilities(ys)
+        max_index = y_reduced.argmax()
+
+        return ArenaSolution(
+            enemy=enemy,
+            attackers=[[self.heroes[i] for i in solutions[max_index, selector]] for selector in team_selectors],
+            probability=y_reduced[max_index],
+            probabilities=list(ys[:, max_index]),
+            stats=SolverStats(n_rows=memo.n_misses, screening_time=perf_counter() - start_time),
+        )
+
+    def make_heuristic_solution(self) -> ndarray:
+        """
+        The heuristic solution puts the most powerful heroes into the teams.
+        """
+        hero_indices = {hero.id: i for i, hero in enumerate(self.heroes)}
+        return numpy.array([hero_indices[hero.id] for hero in naive_select_attackers(self.heroes, len(self.heroes))])
+
+    def solve_halving(
+        self,
+        enemies: List[BaseArenaEnemy],
+        solutions: ndarray,
+        deadline: Optional[float],
+    ) -> List[Tuple[ArenaSolution, Optional[ndarray]]]:
+        """
+        Successive halving: evolve all the enemies for a few generations, then drop the worse half
+        and double the number of generations for the rest, and so on. The last one gets evolved until it's finished.
+        Weaker enemies are unlikely to be selected anyway, thus it's not worth to spend much time on them.
+        All the enemies share the page deadline. Returns the solutions and the final populations.
+        Enemies dropped before their evolution is finished are not solved yet, they get skipped as after the screening,
+        and their population is `None`.
+        """
+        evolutions = {enemy.user_id: self.start_evolution(enemy, solutions, deadline) for enemy in enemies}
+        candidates = list(evolutions)
+        n_generations = self.halving_generations
+        while candidates:
+            is_last = len(candidates) == 1
+            unfinished = [evolutions[user_id] for user_id in candidates if not evolutions[user_id].is_finished]
+            for evolution in self.evolve_all(unfinished, None if is_last else n_generations):
+                evolutions[evolution.enemy.user_id] = evolution
+            if is_last:
+                break
+            candidates.sort(key=lambda user_id: evolutions[user_id].solution.probability, reverse=True)
+            candidates = candidates[:ceil(len(candidates) / 2)]
+            n_generations *= 2
+            logger.debug('Halving: {} candidates left.', len(candidates))
+
+        results: List[Tuple[ArenaSolution, Optional[ndarray]]] = []
+        for evolution in evolutions.values():
+            if evolution.is_finished:
+                results.append((evolution.solution, evolution.solutions))
+                continue
+            logger.debug('Dropped by halving: {}.', evolution.solution)
+            evolution.stats.n_enemies = 0
+            evolution.stats.n_skipped = 1
+            results.append((evolution.solution, None))
+            if evolution.worker is not None:
+                self.pool.executors[evolution.worker].submit(drop_memo_in_worker, evolution.memo_key)
+        return results
+
+    def evolve_all(self, evolutions: List[Evolution], n_generations: Optional[int]) -> Iterable[Evolution]:
+        """
+        Evolve the enemies, in parallel if the pool is running. Returns the updated evolutions.
+        Each evolution sticks to the worker which gets it first, because the worker keeps its memo.
+        """
+        if self.pool is not None:
+            for i, evolution in enumerate(evolutions):
+                if evolution.worker is None:
+                    evolution.worker = i % len(self.pool)
+            workers = [evolution.worker for evolution in evolutions]
+            return self.pool.map(evolve_in_worker, evolutions, repeat(n_generations), workers=workers)
+        for evolution in evolutions:
+            self.evolve(evolution, n_generations)
+        return evolutions
+
+    def make_deadlines(self, n_enemies: int, n_parallel: int = 1) -> List[Optional[float]]:
+        """
+        Make the enemy deadlines for the page. Each of `n_parallel` workers solves its share of the enemies one by one.
+        Deadlines are counted from the page start, thus time left over by an enemy goes to the following ones.
+        """
+        n_rounds = max(ceil(n_enemies / n_parallel), 1)
+        budgets = [self.enemy_time_limit, self.page_time_limit and self.page_time_limit / n_rounds]
+        if not any(budgets):
+            return [None] * n_enemies
+        budget = min(budget for budget in budgets if budget)
+        start_time = time()
+        return [start_time + (i // n_parallel + 1) * budget for i in range(n_enemies)]
+
+    def solve_enemy_from(
+        self,
+        enemy: BaseArenaEnemy,
+        solutions: ndarray,
+        deadline: Optional[float] = None,
+    ) -> Tuple[ArenaSolution, ndarray]:
         """
-        Finds solution for the single enemy.
+        Solve the enemy starting with the specified population. Returns the solution and the final population.
+        """
+        self.solutions = solutions
+        return self.solve_enemy(enemy, deadline), self.solutions
+
+    def solve_enemy(self, enemy: BaseArenaEnemy, deadline: Optional[float] = None) -> ArenaSolution:
+        """
+        Finds solution for the single enemy. Returns the best solution so far once the deadline is reached.
         """
         logger.debug('Solving arena for {}…', enemy)
+        if self.is_exhaustive(enemy):
+            return self.solve_enemy_exhaustively(enemy, deadline)
+        if self.n_islands != 1:
+            return self.solve_enemy_on_islands(enemy, deadline)
+        evolution = self.start_evolution(enemy, self.solutions, deadline)
+        self.evolve(evolution)
+        self.solutions = evolution.solutions
+        return evolution.solution
 
-        n_heroes = len(self.heroes)
-        n_actual_teams = len(enemy.teams)  # at first, we will generate the same number of attacker teams
-        n_attackers = n_actual_teams * TEAM_SIZE
+    def is_exhaustive(self, enemy: BaseArenaEnemy) -> bool:
+        """
+        Small rosters allow to find the true optimum for a single team.
+        """
+        return len(enemy.teams) == 1 and comb(len(self.heroes), TEAM_SIZE) <= self.exhaustive_max_teams
 
-        hero_features = self.make_team_features(self.heroes)
-        defenders_features = [self.make_team_features(team).sum(axis=0) for team in enemy.teams]
+    def make_enemy_features(self, enemy: BaseArenaEnemy) -> Tuple[ndarray, List[ndarray]]:
+        """
+        Make the hero features and the features of each defender team.
+        """
+        hero_features = self.model.make_features(self.heroes)
+        return hero_features, [self.model.make_features(team).sum(axis=0) for team in enemy.teams]
 
-        # Used to speed up selection of separate attacker teams from the solutions array.
-        team_selectors = slices(n_actual_teams, TEAM_SIZE)
-
-        # Generate all possible (per)mutations of a single solution.
-        # We will use it to speed up mutation process by selecting random rows from the `swaps` array.
-        # Each permutation swaps two particular elements so that the heroes get interchanged in the teams.
-        # In total `n_teams + 1` groups.
-        groups = [
-            *[range(selector.start, selector.stop) for selector in team_selectors],
-            range(n_attackers, n_heroes),  # fake group to keep there unused heroes
+    def solve_enemy_on_islands(self, enemy: BaseArenaEnemy, deadline: Optional[float]) -> ArenaSolution:
+        """
+        Island model: evolve separate populations, and let the best solutions migrate between them now and then.
+        Migrants bring in the new genes, which helps the populations to escape local optima.
+        """
+        start_time = perf_counter()
+        islands = [self.start_evolution(enemy, self.solutions, deadline, island) for island in range(self.n_islands)]
+        while not all(evolution.is_finished for evolution in islands):
+            indices = [i for i, evolution in enumerate(islands) if not evolution.is_finished]
+            evolutions = self.evolve_all([islands[i] for i in indices], self.migration_interval)
+            for i, evolution in zip(indices, evolutions):
+                islands[i] = evolution
+            self.migrate(islands)
+            logger.trace('Islands: {}.', ', '.join(f'{100.0 * island.solution.probability:.2f}%' for island in islands))
+
+        stats = SolverStats()
+        for evolution in islands:
+            stats += evolution.stats
+        stats.n_enemies = 1
+        stats.n_timeouts = min(stats.n_timeouts, 1)
+        stats.time = perf_counter() - start_time  # islands may have been evolving in parallel
+        best = max(islands, key=lambda evolution: evolution.solution.probability)
+        best.solution.stats = stats
+        self.solutions = best.solutions
+        return best.solution
+
+    def migrate(self, islands: List[Evolution]):
+        """
+        Ring migration: the best survivors of each island replace the worst survivors of the next island.
+        """
+        n_migrants = min(constants.ARENA_N_MIGRANTS, self.n_keep_solutions)
+        orders = [self.reduce_probabilities(evolution.ys).argsort() for evolution in islands]
+        migrants = [
+            (evolution.solutions[order[-n_migrants:]], evolution.ys[:, order[-n_migrants:]])
+            for evolution, order in zip(islands, orders)
         ]
-        logger.trace('{} hero groups.', len(groups))
-        swaps = vstack([
-            swap_permutation(n_heroes, i, j)  # swap these two heroes
-            for group_1, group_2 in combinations(groups, 2)  # select two groups to interchange heroes in
-            for i, j in product(group_1, group_2)  # select particular indexes to interchange
-        ])
-        logger.trace('Swaps shape: {}.', swaps.shape)
-
-        # Let's evolve.
-        count_down = CountDown(count(1), self.n_generations_count_down)
-        solution = ArenaSolution(enemy=enemy, attackers=[], probability=0.0, probabilities=[])
-
-        for n_generation in count_down:
-            # Generate new solutions.
-            # Choose random solutions from the population and apply a random permutation to each of them.
-            new_permutations = swaps[randint(0, swaps.shape[0], self.n_generate_solutions)]
-            new_solutions = self.solutions[
-                choice(self.solutions.shape[0], self.n_generate_solutions).reshape(-1, 1),
-                new_permutations
-            ]
-
-            # Stack old solutions with the new ones.
-            self.solutions = vstack((self.solutions, new_solutions))
-
-            # Predict probabilities.
-            # Call to `predict_proba` is expensive, thus call it for all the teams at once. Stack and split.
-            x = vstack([
-                hero_features[self.solutions[:, selector]].sum(axis=1) - defender_features
-                for selector, defender_features in zip(team_selectors, defenders_features)
-            ])
-            ys = numpy.split(self.model.estimator.predict_proba(x)[:, 1], n_actual_teams)
-
-            # Convert individual battle probabilities to the final arena battle probabilities.
-            y_reduced = self.reduce_probabilities(*ys)
-
-            # Select top solutions for the next iteration.
-            # See also: https://stackoverflow.com/a/23734295/359730
-            top_indexes = y_reduced.argpartition(-self.n_keep_solutions)[-self.n_keep_solutions:]
-
-            # All the arrays must be cut to the top indexes, otherwise their rows won't correspond to each other.
-            self.solutions = self.solutions[top_indexes, :]
-            y_reduced = y_reduced[top_indexes]
-            ys = [y[top_indexes] for y in ys]
+        for evolution, order, (solutions, ys) in zip(islands[1:] + islands[:1], orders[1:] + orders[:1], migrants):
+            evolution.solutions[order[:n_migrants]] = solutions
+            evolution.ys[:, order[:n_migrants]] = ys
+
+    def start_evolution(
+        self,
+        enemy: BaseArenaEnemy,
+        solutions: ndarray,
+        deadline: Optional[float] = None,
+        island: int = 0,
+    ) -> Evolution:
+        """
+        Start evolving the population against the enemy. Each island gets its own random state.
+        """
+        start_time = perf_counter()
+        stats = SolverStats(n_enemies=1)
+        timer = PhaseTimer(stats.timings if self.profile else None)
+        n_teams = len(enemy.teams)  # at first, we will generate the same number of attacker teams
+        hero_features, defenders_features = self.make_enemy_features(enemy)
+        timer.lap('setup')
+
+        # Survivors carry their probabilities along, so only the new solutions get predicted in each generation.
+        # However, the population has been evolved against another enemy, thus it needs to be scored once.
+        # The heuristic solution joins the population unless it's already there, the same as in the screening.
+        memo = TeamMemo(constants.ARENA_MEMO_SIZE)
+        team_selectors = slices(n_teams, TEAM_SIZE)
+        heuristic_solution = self.make_heuristic_solution()
+        if not (solutions == heuristic_solution).all(axis=1).any():
+            solutions = vstack([heuristic_solution, solutions]).astype(solutions.dtype)
+        else:
+            solutions = solutions.copy()  # the teams may get reassigned in place
+        stats.n_solutions = len(solutions)
+        ys = numpy.empty((n_teams, len(solutions)))
+        x, x_heroes = self.make_buffers(enemy, len(solutions), hero_features.shape[1])
+        self.get_predictor(enemy)(
+            solutions, hero_features, defenders_features, team_selectors, memo, timer,
+            out=ys, x=x, x_heroes=x_heroes,
+        )
+        timer.lap('memo')  # including the teardown of the keys
+        y_reduced = self.reduce_probabilities(ys)
+        if len(solutions) > self.n_keep_solutions:
+            # The worst solution gives way to the heuristic one.
+            kept_indices = numpy.sort(y_reduced.argsort()[1:])
+            solutions, ys, y_reduced = solutions[kept_indices], ys[:, kept_indices], y_reduced[kept_indices]
+
+        # The best starting solution is the initial one, thus solving never ends up worse than the screening.
+        max_index = y_reduced.argmax()
+        stats.n_rows = stats.n_best_rows = memo.n_misses
+
+        stats.time = perf_counter() - start_time
+        return Evolution(
+            enemy=enemy,
+            random_state=self.make_random_state(enemy, island),
+            solutions=solutions,
+            ys=ys,
+            memo=memo,
+            solution=ArenaSolution(
+                enemy=enemy,
+                attackers=[[self.heroes[i] for i in solutions[max_index, selector]] for selector in team_selectors],
+                probability=y_reduced[max_index],
+                probabilities=list(ys[:, max_index]),
+                stats=stats,
+            ),
+            stats=stats,
+            n_generations_left=self.n_generations_count_down,
+            deadline=deadline,
+            island=island,
+        )
+
+    def evolve(self, evolution: Evolution, n_generations: Optional[int] = None):
+        """
+        Evolve the population for the number of generations, or until the evolution is finished.
+        """
+        start_time = perf_counter()
+        enemy = evolution.enemy
+        memo = evolution.memo
+        stats = evolution.stats
+        solution = evolution.solution
+        timer = PhaseTimer(stats.timings if self.profile else None)
+        engine = ENGINES[self.engine](self, evolution, timer)
+        n_misses = memo.n_misses
+        timer.lap('setup')
+
+        for _ in (count() if n_generations is None else range(n_generations)):
+            stats.n_generations += 1
+            n_generation = stats.n_generations
+            evolution.n_generations_left -= 1
+            y_reduced = engine.step()
 
             # Select the best solution of this generation.
+            # Unlike the genetic algorithm, the other engines may lose the best solution on their way.
             old_probability = solution.probability
             max_index = y_reduced.argmax()
-            solution = ArenaSolution(
-                enemy=enemy,
-                attackers=[
-                    [self.heroes[i] for i in self.solutions[max_index, selector]]
-                    for selector in team_selectors
-                ],
-                probability=y_reduced[max_index],
-                probabilities=[y[max_index] for y in ys],
-            )
+            if y_reduced[max_index] >= old_probability:
+                solution = ArenaSolution(
+                    enemy=enemy,
+                    attackers=[
+                        [self.heroes[i] for i in engine.population[max_index, selector]]
+                        for selector in engine.team_selectors
+                    ],
+                    probability=y_reduced[max_index],
+                    probabilities=list(engine.ys[:, max_index]),
+                    stats=stats,
+                )
+            stats.n_solutions += engine.n_new
+            # Each unique team missing in the memo gets scored exactly once.
+            stats.n_rows += memo.n_misses - n_misses
+            n_misses = memo.n_misses
+            if solution.probability > old_probability:
+                stats.n_best_rows = stats.n_rows
             if solution.probability - old_probability >= 0.00001:
                 # The solution has been improved. Give the optimizer another chance to beat it.
-                count_down.reset()
+                evolution.n_generations_left = self.n_generations_count_down
                 logger.trace('Bump: +{:.3f}%.', 100.0 * (solution.probability - old_probability))
-            logger.trace('Generation {:2}: {:.2f}% ({:d})', n_generation, 100.0 * solution.probability, int(count_down))
+            logger.trace(
+                'Generation {:2}: {:.2f}% ({:d}), {} new, memo: {} hits, {} misses, {} teams.',
+                n_generation, 100.0 * solution.probability, evolution.n_generations_left, engine.n_new,
+                memo.n_hits, memo.n_misses, len(memo),
+            )
+            timer.lap('other')
+
+            if not evolution.n_generations_left or engine.is_converged:
+                evolution.is_finished = True
+                break
 
             # I'm feeling lucky!
             # It makes sense to stop if the probability is already close to 100%.
             if solution.probability > 0.99999:
+                evolution.is_finished = True
                 break
 
-        return solution
+            if evolution.deadline is not None and time() >= evolution.deadline:
+                logger.debug('Out of time at generation {}.', n_generation)
+                stats.n_timeouts = 1
+                evolution.is_finished = True
+                break
+
+        # Don't keep the large buffers alive.
+        evolution.solutions = engine.population.copy()
+        evolution.ys = engine.ys.copy()
+        evolution.solution = solution
+        stats.time += perf_counter() - start_time
+
+    def solve_enemy_exhaustively(self, enemy: BaseArenaEnemy, deadline: Optional[float]) -> ArenaSolution:
+        """
+        Finds the best single team by scoring all the hero combinations.
+        Returns the best team so far once the deadline is reached.
+        """
+        logger.debug('Scoring all {} teams…', comb(len(self.heroes), TEAM_SIZE))
+        start_time = perf_counter()
+        stats = SolverStats(n_enemies=1)
+        timer = PhaseTimer(stats.timings if self.profile else None)
+        hero_features, (defender_features,) = self.make_enemy_features(enemy)
+        probability = -1.0
+        attackers: List[int] = []
+        timer.lap('setup')
+
+        for x, teams in self.yield_all_teams(hero_features, defender_features):
+            timer.lap('features')
+            y = self.model.predict_proba(x)
+            timer.lap('predict')
+            stats.n_solutions += len(x)
+            stats.n_rows += len(x)
+            max_index = y.argmax()
+            if y[max_index] > probability:
+                probability = y[max_index]
+                attackers = teams[max_index].tolist()
+                stats.n_best_rows = stats.n_rows
+            timer.lap('select')
+            if deadline is not None and time() >= deadline:
+                logger.debug('Out of time after {} teams.', stats.n_rows)
+                stats.n_timeouts = 1
+                break
+
+        stats.time = perf_counter() - start_time
+        return ArenaSolution(
+            enemy=enemy,
+            attackers=[[self.heroes[i] for i in attackers]],
+            probability=probability,
+            probabilities=[probability],
+            stats=stats,
+        )
+
+    @staticmethod
+    def yield_all_teams(hero_features: ndarray, defender_features: ndarray) -> Iterable[Tuple[ndarray, ndarray]]:
+        """
+        Yield feature rows for all the possible teams in chunks, along with the corresponding hero indices.
+        The arrays get reused, the caller must be done with them before asking for the next chunk.
+        """
+        n_heroes, n_features = hero_features.shape
+
+        # Each team is a triple of heroes followed by a pair of heroes with greater indices.
+        # Pairs go in the lexicographical order, thus the pairs which can follow a triple form the array tail.
+        pairs = numpy.array(list(combinations(range(n_heroes), 2))).reshape(-1, 2)
+        pair_features = hero_features[pairs[:, 0]] + hero_features[pairs[:, 1]]
+        pair_starts = numpy.searchsorted(pairs[:, 0], arange(n_heroes + 1))  # first pair index for each first hero
+
+        chunk_size = max(constants.ARENA_EXHAUSTIVE_CHUNK_SIZE, len(pairs))
+        x = numpy.empty((chunk_size, n_features))
+        teams = numpy.empty((chunk_size, TEAM_SIZE), dtype=int)
+        n_rows = 0
+
+        for a, b, c in combinations(range(n_heroes - 2), 3):
+            start = pair_starts[c + 1]
+            n_pairs = len(pairs) - start
+            if n_rows + n_pairs > chunk_size:
+                yield x[:n_rows], teams[:n_rows]
+                n_rows = 0
+            # Team features are built incrementally: pair, triple and then the whole team.
+            triple_features = pair_features[pair_starts[a] + (b - a - 1)] + hero_features[c] - defender_features
+            numpy.add(pair_features[start:], triple_features, out=x[n_rows:n_rows + n_pairs])
+            teams[n_rows:n_rows + n_pairs, :3] = (a, b, c)
+            teams[n_rows:n_rows + n_pairs, 3:] = pairs[start:]
+            n_rows += n_pairs
+
+        if n_rows:
+            yield x[:n_rows], teams[:n_rows]
+
+    def make_random_state(self, enemy: BaseArenaEnemy, island: int = 0) -> RandomState:
+        """
+        Make the enemy random state. It depends only on the solver seed and the enemy, not on the solving order.
+        """
+        seed = [self.seed, crc32(enemy.user_id.encode())]
+        return RandomState([*seed, island] if island else seed)
+
+    def get_predictor(self, enemy: BaseArenaEnemy) -> Callable[..., None]:
+        """
+        Get the method to predict battles against the enemy.
+        """
+        return self.predict_assigned_battles if self.is_assigned(enemy) else self.predict_battles
 
-    def make_hero_features(self, hero: Hero) -> ndarray:
+    def is_assigned(self, enemy: BaseArenaEnemy) -> bool:
+        return self.assign_teams and len(enemy.teams) != 1
+
+    def make_buffers(self, enemy: BaseArenaEnemy, n_solutions: int, n_features: int) -> Tuple[ndarray, ndarray]:
         """
-        Make hero features 1D-array.
+        Make the feature buffers for the predictor to score the number of solutions at once.
+        Team assignment scores each attacker team against each defender team, thus it needs more rows.
         """
-        return numpy.fromiter((hero.features.get(name, 0.0) for name in self.model.feature_names), numpy.float)
+        n_teams_per_defender = len(enemy.teams) if self.is_assigned(enemy) else 1
+        return (
+            numpy.empty((len(enemy.teams) * n_teams_per_defender * n_solutions, n_features)),
+            numpy.empty((n_teams_per_defender * n_solutions, n_features)),
+        )
 
-    def make_team_features(self, team: List[Hero]) -> ndarray:
+    def predict_assigned_battles(
+        self,
+        solutions: ndarray,
+        hero_features: ndarray,
+        defenders_features: List[ndarray],
+        team_selectors: List[slice],
+        memo: TeamMemo,
+        timer: PhaseTimer,
+        *,
+        out: ndarray,
+        x: ndarray,
+        x_heroes: ndarray,
+    ):
+        """
+        Predict battles of each attacker team against each defender team, and then reorder the attacker teams
+        of each solution in place, so that they face the defenders in the best possible assignment.
+        Individual battle probabilities of the assigned teams go into `out`, see also `predict_battles`.
+
+        :param x: buffer for the feature rows, must fit a row per each solution for each attacker and defender pair.
+        :param x_heroes: buffer for hero features, must fit a row per each solution for each attacker team.
         """
-        Make team features 2D-array. Shape is number of heroes × number of features.
+        n_teams = len(team_selectors)
+        n_solutions = len(solutions)
+
+        # `probabilities[i, j]` are the probabilities of the attacker teams `i` against the defender team `j`.
+        # All the pairs go into the single batch, so that `predict_proba` gets called once.
+        probabilities = numpy.empty((n_teams, n_teams, n_solutions))
+        self.predict_battles(
+            solutions, hero_features, defenders_features,
+            [selector for selector in team_selectors for _ in range(n_teams)], memo, timer,
+            out=probabilities.reshape(n_teams * n_teams, n_solutions), x=x, x_heroes=x_heroes,
+            defenders=[j for _ in range(n_teams) for j in range(n_teams)],
+        )
+
+        # There are just a few assignments, thus it's cheap to check all of them.
+        assignments = numpy.array(list(permutations(range(n_teams))))  # attacker team index for each defender team
+        y_reduced = numpy.stack([
+            self.reduce_probabilities(probabilities[assignment, arange(n_teams)])
+            for assignment in assignments
+        ])
+        timer.lap('reduce')
+
+        order = assignments[y_reduced.argmax(axis=0)]  # attacker team index for each defender team, per solution
+        attackers = solutions[:, :n_teams * TEAM_SIZE].reshape(n_solutions, n_teams, TEAM_SIZE)
+        attackers[:] = numpy.take_along_axis(attackers, order[:, :, numpy.newaxis], axis=1)
+        out[:] = probabilities[order.T, arange(n_teams).reshape(-1, 1), arange(n_solutions)]
+        timer.lap('assign')
+
+    def predict_battles(
+        self,
+        solutions: ndarray,
+        hero_features: ndarray,
+        defenders_features: List[ndarray],
+        team_selectors: List[slice],
+        memo: TeamMemo,
+        timer: PhaseTimer,
+        *,
+        out: ndarray,
+        x: ndarray,
+        x_heroes: ndarray,
+        defenders: Optional[List[int]] = None,
+    ):
         """
-        return vstack([self.make_hero_features(hero) for hero in team])
+        Predict individual battle probabilities into `out`, one row per battle.
+        Only the teams which are missing in the memo get predicted.
+
+        :param x: buffer for the feature rows, must fit a row per each solution for each battle.
+        :param x_heroes: buffer for hero features, must fit all the battles against a single defender team.
+        :param defenders: defender team index for each of the attacker team selectors, the same index by default.
+        """
+        if defenders is None:
+            defenders = list(range(len(team_selectors)))
+
+        # Order of heroes within a team doesn't matter, so the sorted hero indices identify the team.
+        keys = [
+            [(defender, team.tobytes()) for team in numpy.sort(solutions[:, selector], axis=1)]
+            for defender, selector in zip(defenders, team_selectors)
+        ]
+
+        # Look up the known teams and collect the unique unknown ones for each defender team.
+        probabilities: Dict[Tuple[int, bytes], float] = {}
+        missing: List[Dict[Tuple[int, bytes], ndarray]] = [{} for _ in defenders_features]
+        for defender, team_keys, selector in zip(defenders, keys, team_selectors):
+            for key, team in zip(team_keys, solutions[:, selector]):
+                if key in probabilities or key in missing[defender]:
+                    continue
+                if (probability := memo.get(key)) is not None:
+                    probabilities[key] = probability
+                else:
+                    missing[defender][key] = team
+        timer.lap('memo')
+
+        if any(missing):
+            # Call to `predict_proba` is expensive, thus call it for all the teams at once.
+            n_rows = 0
+            for teams, defender_features in zip(missing, defenders_features):
+                if teams:
+                    make_battle_features(
+                        hero_features,
+                        vstack(list(teams.values())),
+                        defender_features,
+                        out=x[n_rows:n_rows + len(teams)],
+                        x_heroes=x_heroes[:len(teams)],
+                    )
+                    n_rows += len(teams)
+            timer.lap('features')
+            y = self.model.predict_proba(x[:n_rows])
+            timer.lap('predict')
+            predicted = dict(zip((key for teams in missing for key in teams), y))
+            probabilities.update(predicted)
+            memo.update(predicted)
+
+        for n_battle, team_keys in enumerate(keys):
+            out[n_battle] = [probabilities[key] for key in team_keys]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The database, the callbacks and the pool are not needed in a worker process and can't be pickled anyway.
+        return {**self.__dict__, 'db': {}, 'get_enemies': list, 'callback': None, 'pool': None, 'cache': {}}
+
+
+# Worker processes.
+# ----------------------------------------------------------------------------------------------------------------------
+
+# Memos of the evolutions which stick to the worker process.
+worker_memos: Dict[Tuple[str, int], TeamMemo] = {}
+
+
+def get_worker_solver() -> ArenaSolver:
+    # Each worker process receives its own solver copy, including the model, once at start.
+    solver, = get_worker_state()
+    return solver
+
+
+def solve_enemy_in_worker(
+    enemy: BaseArenaEnemy,
+    solutions: ndarray,
+    deadline: Optional[float],
+) -> Tuple[ArenaSolution, ndarray]:
+    return get_worker_solver().solve_enemy_from(enemy, solutions, deadline)
+
+
+def evolve_in_worker(evolution: Evolution, n_generations: Optional[int]) -> Evolution:
+    # The memo comes along with the evolution on its first round only. After that, the worker keeps it,
+    # because it may be huge and it's not worth sending it back and forth on every round.
+    memo = worker_memos.setdefault(evolution.memo_key, evolution.memo)
+    evolution.memo = memo
+    get_worker_solver().evolve(evolution, n_generations)
+    evolution.memo = TeamMemo(memo.max_size)
+    if evolution.is_finished:
+        del worker_memos[evolution.memo_key]
+    return evolution
+
+
+def drop_memo_in_worker(memo_key: Tuple[str, int]):
+    worker_memos.pop(memo_key, None)
+
+
+# Engines.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class Engine(ABC):
+    """
+    Search strategy which evolves the population of the solutions against the enemy, one generation at a time.
+    The current population and its individual battle probabilities are exposed as `population` and `ys`.
+    """
+
+    population: ndarray
+    ys: ndarray
+
+    def __init__(self, solver: ArenaSolver, evolution: Evolution, timer: PhaseTimer):
+        self.solver = solver
+        self.evolution = evolution
+        self.timer = timer
+        self.n_heroes = len(solver.heroes)
+        self.n_teams = len(evolution.enemy.teams)
+        self.hero_features, self.defenders_features = solver.make_enemy_features(evolution.enemy)
+
+        # Used to speed up selection of separate attacker teams from the solutions array.
+        self.team_selectors = slices(self.n_teams, TEAM_SIZE)
+
+        # All the engines explore the same neighbourhood: a neighbour differs from the solution by a single swap.
+        self.swaps = make_swaps(self.n_heroes, self.team_selectors)
+        self.dtype = solver.hero_dtype
+        self.predictor = solver.get_predictor(evolution.enemy)
+
+        self.n_new = 0  # number of new solutions scored in the last generation
+        self.is_converged = False  # it makes no sense to continue
+
+    @abstractmethod
+    def step(self) -> ndarray:
+        """
+        Evolve the next generation. Returns the arena win probabilities of the population.
+        """
+        raise NotImplementedError()
+
+    def predict_battles(self, solutions: ndarray, *, out: ndarray, x: ndarray, x_heroes: ndarray):
+        self.predictor(
+            solutions, self.hero_features, self.defenders_features, self.team_selectors, self.evolution.memo,
+            self.timer, out=out, x=x, x_heroes=x_heroes,
+        )
+
+    def make_buffers(self, n_solutions: int) -> Tuple[ndarray, ndarray]:
+        """
+        Make the feature buffers to score the number of solutions at once.
+        """
+        return self.solver.make_buffers(self.evolution.enemy, n_solutions, self.hero_features.shape[1])
+
+
+class GeneticEngine(Engine):
+    """
+    Random swaps of the survivors produce the offspring, and the best of them survive in turn.
+    """
+
+    def __init__(self, solver: ArenaSolver, evolution: Evolution, timer: PhaseTimer):
+        super().__init__(solver, evolution, timer)
+
+        # The population lives in preallocated buffers: survivors go first, and their offspring follow them.
+        # Survivors of each generation get selected into the spare buffers, and then the buffers get swapped.
+        self.n_keep = n_keep = solver.n_keep_solutions
+        self.n_generate = n_generate = solver.n_generate_solutions
+        self.population_buffer = numpy.empty((n_keep + n_generate, self.n_heroes), dtype=self.dtype)
+        self.spare_population_buffer = numpy.empty_like(self.population_buffer)
+        self.ys_buffer = numpy.empty((self.n_teams, n_keep + n_generate))  # individual battle probabilities
+        self.spare_ys_buffer = numpy.empty_like(self.ys_buffer)
+        self.canonical = numpy.empty((n_keep + n_generate, self.n_teams, TEAM_SIZE), dtype=self.dtype)
+        self.x, self.x_heroes = self.make_buffers(n_generate)
+        self.population_buffer[:n_keep] = evolution.solutions
+        self.ys_buffer[:, :n_keep] = evolution.ys
+
+    @property
+    def population(self) -> ndarray:
+        return self.population_buffer[:self.n_keep]
+
+    @property
+    def ys(self) -> ndarray:
+        return self.ys_buffer[:, :self.n_keep]
+
+    def step(self) -> ndarray:
+        n_keep = self.n_keep
+        n_generate = self.n_generate
+        random_state = self.evolution.random_state
+        population = self.population_buffer
+        spare_population = self.spare_population_buffer
+        ys = self.ys_buffer
+        timer = self.timer
+
+        # Generate new solutions.
+        # Choose random solutions from the population and apply a random swap to each of them.
+        # With the `clip` mode, `take` doesn't buffer the output. The indices are valid anyway.
+        # The spare population tail is free at the moment, so the offspring get drafted there.
+        swaps = self.swaps.take(random_state.randint(0, len(self.swaps), n_generate), axis=0)
+        population[:n_keep].take(
+            random_state.choice(n_keep, n_generate), axis=0, out=spare_population[n_keep:], mode='clip',
+        )
+        swap_heroes(spare_population[n_keep:], swaps)
+        timer.lap('mutation')
+
+        # Duplicates would waste the survivor slots, so only the really new solutions join the population.
+        unique_indices = find_unique_offspring(population[:n_keep], spare_population[n_keep:], out=self.canonical)
+        self.n_new = len(unique_indices)
+        n_population = n_keep + self.n_new
+        spare_population[n_keep:].take(unique_indices, axis=0, out=population[n_keep:n_population], mode='clip')
+        timer.lap('deduplicate')
+
+        self.predict_battles(
+            population[n_keep:n_population], out=ys[:, n_keep:n_population], x=self.x, x_heroes=self.x_heroes,
+        )
+        timer.lap('memo')
+
+        # Convert individual battle probabilities to the final arena battle probabilities.
+        y_reduced = self.solver.reduce_probabilities(ys[:, :n_population])
+        timer.lap('reduce')
+
+        # Select top solutions for the next iteration.
+        # See also: https://stackoverflow.com/a/23734295/359730
+        top_indexes = y_reduced.argpartition(-n_keep)[-n_keep:]
+
+        # All the arrays must be cut to the top indexes, otherwise their rows won't correspond to each other.
+        population.take(top_indexes, axis=0, out=spare_population[:n_keep], mode='clip')
+        for y, spare_y in zip(ys, self.spare_ys_buffer):
+            y.take(top_indexes, out=spare_y[:n_keep], mode='clip')
+        self.population_buffer, self.spare_population_buffer = spare_population, population
+        self.ys_buffer, self.spare_ys_buffer = self.spare_ys_buffer, ys
+        timer.lap('select')
+        return y_reduced[top_indexes]
+
+
+class AnnealingEngine(Engine):
+    """
+    Simulated annealing of each solution of the population independently.
+    Each solution samples a few random neighbours and moves to the best of them, even if it's worse,
+    with the probability which decreases along with the temperature.
+    """
+
+    def __init__(self, solver: ArenaSolver, evolution: Evolution, timer: PhaseTimer):
+        super().__init__(solver, evolution, timer)
+        self.population = evolution.solutions.copy()
+        self.ys = evolution.ys.copy()
+        self.n_samples = max(solver.n_generate_solutions // len(self.population), 1)  # neighbours per solution
+        self.neighbours = numpy.empty((len(self.population) * self.n_samples, self.n_heroes), dtype=self.dtype)
+        self.neighbour_ys = numpy.empty((self.n_teams, len(self.neighbours)))
+        self.x, self.x_heroes = self.make_buffers(len(self.neighbours))
+        self.origins = numpy.repeat(arange(len(self.population)), self.n_samples)
+
+    def step(self) -> ndarray:
+        random_state = self.evolution.random_state
+        n_solutions = len(self.population)
+
+        swaps = self.swaps.take(random_state.randint(0, len(self.swaps), len(self.neighbours)), axis=0)
+        self.population.take(self.origins, axis=0, out=self.neighbours, mode='clip')
+        swap_heroes(self.neighbours, swaps)
+        self.n_new = len(self.neighbours)
+        self.timer.lap('mutation')
+
+        self.predict_battles(self.neighbours, out=self.neighbour_ys, x=self.x, x_heroes=self.x_heroes)
+        self.timer.lap('memo')
+
+        y_reduced = self.solver.reduce_probabilities(self.ys)
+        neighbour_reduced = self.solver.reduce_probabilities(self.neighbour_ys).reshape(n_solutions, self.n_samples)
+        self.timer.lap('reduce')
+
+        # Metropolis criterion: better neighbours are always accepted, and worse ones are accepted by chance.
+        best_indices = neighbour_reduced.argmax(axis=1)
+        deltas = neighbour_reduced[arange(n_solutions), best_indices] - y_reduced
+        cooling = constants.ARENA_ANNEALING_COOLING ** self.evolution.stats.n_generations
+        temperature = max(constants.ARENA_ANNEALING_TEMPERATURE * cooling, constants.ARENA_ANNEALING_MIN_TEMPERATURE)
+        is_accepted = random_state.random_sample(n_solutions) < numpy.exp(numpy.minimum(deltas, 0.0) / temperature)
+        accepted_indices = arange(n_solutions)[is_accepted] * self.n_samples + best_indices[is_accepted]
+        self.population[is_accepted] = self.neighbours[accepted_indices]
+        self.ys[:, is_accepted] = self.neighbour_ys[:, accepted_indices]
+        self.timer.lap('select')
+        return self.solver.reduce_probabilities(self.ys)
+
+
+class ClimbingEngine(Engine):
+    """
+    Best-improvement hill climbing from the best solution of the population.
+    Each generation scores all the neighbours and moves to the best of them, until there is no better one.
+    """
+
+    def __init__(self, solver: ArenaSolver, evolution: Evolution, timer: PhaseTimer):
+        super().__init__(solver, evolution, timer)
+        self.population = evolution.solutions.copy()
+        self.ys = evolution.ys.copy()
+        self.neighbours = numpy.empty((len(self.swaps), self.n_heroes), dtype=self.dtype)
+        self.neighbour_ys = numpy.empty((self.n_teams, len(self.neighbours)))
+        self.x, self.x_heroes = self.make_buffers(len(self.neighbours))
+
+    def step(self) -> ndarray:
+        # Only the best solution climbs, the other ones stay for the next enemies.
+        y_reduced = self.solver.reduce_probabilities(self.ys)
+        index = y_reduced.argmax()
+        self.neighbours[:] = self.population[index]
+        swap_heroes(self.neighbours, self.swaps)
+        self.n_new = len(self.neighbours)
+        self.timer.lap('mutation')
+
+        self.predict_battles(self.neighbours, out=self.neighbour_ys, x=self.x, x_heroes=self.x_heroes)
+        self.timer.lap('memo')
+
+        neighbour_reduced = self.solver.reduce_probabilities(self.neighbour_ys)
+        self.timer.lap('reduce')
+
+        best_index = neighbour_reduced.argmax()
+        if neighbour_reduced[best_index] > y_reduced[index]:
+            self.population[index] = self.neighbours[best_index]
+            self.ys[:, index] = self.neighbour_ys[:, best_index]
+        else:
+            self.is_converged = True  # local optimum
+        self.timer.lap('select')
+        return self.solver.reduce_probabilities(self.ys)
+
+
+ENGINES: Dict[ArenaEngine, Type[Engine]] = {
+    ArenaEngine.GENETIC: GeneticEngine,
+    ArenaEngine.ANNEALING: AnnealingEngine,
+    ArenaEngine.CLIMBING: ClimbingEngine,
+}
 
 
 # Utilities.
 # ----------------------------------------------------------------------------------------------------------------------
 
-def swap_permutation(size: int, index_1: int, index_2: int) -> ndarray:
-    permutation = arange(size)
-    permutation[[index_1, index_2]] = permutation[[index_2, index_1]]
-    return permutation
+class PhaseTimer:
+    """
+    Adds up time elapsed between the consecutive `lap` calls to the phase ending with the call.
+    """
 
+    def __init__(self, timings: Optional[Dict[str, float]]):
+        """
+        :param timings: phase timings to add up to, `None` turns the timer off.
+        """
+        self.timings = timings
+        self.last_time = perf_counter()
 
-def reduce_normal_arena(y: ndarray) -> ndarray:
+    def lap(self, phase: str):
+        if self.timings is not None:
+            now = perf_counter()
+            self.timings[phase] = self.timings.get(phase, 0.0) + (now - self.last_time)
+            self.last_time = now
+
+
+class TeamMemo:
+    """
+    Bounded memo of single battle probabilities. Keys are defender team index and attacker team key.
+    The oldest items get evicted once the size limit is exceeded.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.probabilities: OrderedDict[Tuple[int, bytes], float] = OrderedDict()
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def get(self, key: Tuple[int, bytes]) -> Optional[float]:
+        probability = self.probabilities.get(key)
+        if probability is not None:
+            self.n_hits += 1
+        else:
+            self.n_misses += 1
+        return probability
+
+    def update(self, probabilities: Dict[Tuple[int, bytes], float]):
+        self.probabilities.update(probabilities)
+        # Unlike a plain dict, popping the first item doesn't have to skip over the earlier deleted ones.
+        for _ in range(len(self.probabilities) - self.max_size):
+            self.probabilities.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.probabilities)
+
+
+def make_battle_features(
+    hero_features: ndarray,
+    teams: ndarray,
+    defender_features: ndarray,
+    *,
+    out: ndarray,
+    x_heroes: ndarray,
+) -> ndarray:
+    """
+    Make feature rows for the attacker teams against the defender team, without allocating temporary arrays.
+
+    :param hero_features: hero features 2D-array.
+    :param teams: hero indices 2D-array, a row per attacker team.
+    :param defender_features: defender team features 1D-array.
+    :param out: output buffer, a row per attacker team.
+    :param x_heroes: buffer of the same shape as `out`.
+    """
+    # With the `clip` mode, `take` doesn't buffer the output. The indices are valid anyway.
+    hero_features.take(teams[:, 0], axis=0, out=out, mode='clip')
+    for i in range(1, teams.shape[1]):
+        out += hero_features.take(teams[:, i], axis=0, out=x_heroes, mode='clip')
+    out -= defender_features
+    return out
+
+
+def find_unique_offspring(survivors: ndarray, offspring: ndarray, *, out: ndarray) -> ndarray:
+    """
+    Find the offspring which differ from the survivors and from each other. Returns their indices in order.
+    Solutions are equivalent when they consist of the same teams, regardless of the hero order.
+
+    :param out: buffer for the canonical solutions. Shape is number of all solutions × number of teams × team size.
     """
-    For the normal one-battle arena it's just the probabilities themselves.
+    n_survivors = len(survivors)
+    n_attackers = out.shape[1] * TEAM_SIZE
+    out[:n_survivors] = survivors[:, :n_attackers].reshape(n_survivors, -1, TEAM_SIZE)
+    out[n_survivors:] = offspring[:, :n_attackers].reshape(len(offspring), -1, TEAM_SIZE)
+    out.sort(axis=2)
+    keys = {solution.tobytes() for solution in out[:n_survivors]}
+    indices = []
+    for i, solution in enumerate(out[n_survivors:]):
+        if (key := solution.tobytes()) not in keys:
+            keys.add(key)
+            indices.append(i)
+    return numpy.array(indices, dtype=numpy.intp)
+
+
+def make_swaps(n_heroes: int, team_selectors: List[slice]) -> ndarray:
     """
-    return y
+    Generate all possible mutations of a single solution, a row of the two hero positions to swap per mutation.
+    We will use it to speed up mutation process by selecting random rows from the `swaps` array.
+    The heroes get interchanged between the teams, or between a team and the unused heroes.
+    """
+    # In total `n_teams + 1` groups.
+    groups = [
+        *[range(selector.start, selector.stop) for selector in team_selectors],
+        range(team_selectors[-1].stop, n_heroes),  # fake group to keep there unused heroes
+    ]
+    return numpy.array([
+        (i, j)  # swap these two heroes
+        for group_1, group_2 in combinations(groups, 2)  # select two groups to interchange heroes in
+        for i, j in product(group_1, group_2)  # select particular indexes to interchange
+    ], dtype=numpy.intp).reshape(-1, 2)
 
 
-def reduce_grand_arena(y1: ndarray, y2: ndarray, y3: ndarray) -> ndarray:
+def swap_heroes(solutions: ndarray, swaps: ndarray):
     """
-    Gives probability to win at least two of three battles.
+    Swap the two heroes in each solution in place. `swaps` has a row of the two hero positions per solution.
     """
-    return y1 * y2 * y3 + y1 * y2 * (1.0 - y3) + y2 * y3 * (1.0 - y1) + y1 * y3 * (1.0 - y2)
+    # Gather both of the heroes before scattering them back in the reverse order.
+    rows = arange(len(solutions)).reshape(-1, 1)
+    solutions[rows, swaps] = solutions[rows, swaps[:, ::-1]]
+
+
+def reduce_at_least(ys: ndarray, *, k: int) -> ndarray:
+    """
+    Gives probability to win at least `k` battles, given individual battle probabilities, one row per battle.
+    The number of wins follows the Poisson binomial distribution, which is computed battle by battle.
+    """
+    # `p[i]` is the probability to have won exactly `i` of the battles so far, and `p[k]` is for at least `k`.
+    p = numpy.zeros((k + 1, *ys.shape[1:]))
+    p[0] = 1.0
+    buffer = numpy.empty_like(p[0])
+    for y in ys:
+        # Going from the top, so that `p[i - 1]` is still the previous one.
+        p[k] += numpy.multiply(p[k - 1], y, out=buffer)
+        for i in range(k - 1, 0, -1):
+            p[i] += numpy.multiply(numpy.subtract(p[i - 1], p[i], out=buffer), y, out=buffer)
+        p[0] -= numpy.multiply(p[0], y, out=buffer)
+    return p[k]
+
 
+# The normal arena is a single battle, and the grand arena is won by winning at least two of three battles.
+reduce_normal_arena = partial(reduce_at_least, k=1)
+reduce_grand_arena = partial(reduce_at_least, k=2)
 
-# Tester.
+
+# Benchmark.
 # ----------------------------------------------------------------------------------------------------------------------
 
 @click.command()
 @click.option('verbosity', '-v', '--verbose', count=True, help='Increase verbosity.')
-def main(verbosity: int):
-    """Test the solver on the pre-dumped data."""
+@click.option('--n-heroes', type=int, help='Use only N most powerful heroes.')
+@click.option('--n-seeds', type=click.IntRange(min=1), default=5, help='Solve each enemy N times.', show_default=True)
+@click.option(
+    '--exhaustive-max-teams',
+    type=int,
+    default=1000000,
+    help='Also run the exhaustive search for the normal arena if there are not more teams.',
+    show_default=True,
+)
+@click.option(
+    'overrides',
+    '-s',
+    '--setting',
+    multiple=True,
+    metavar='NAME=VALUE',
+    help='Override an arena setting, for example: -s grand_keep_solutions=100.',
+)
+@click.option(
+    'engines',
+    '-e',
+    '--engine',
+    type=click.Choice([engine.value for engine in ArenaEngine]),
+    multiple=True,
+    help='Compare the engines instead of the configured ones.',
+)
+@click.option('--profile/--no-profile', default=True, help='Measure the solver phases.', show_default=True)
+@click.option('--trace-memory', is_flag=True, help='Measure peak memory allocated by each run, slows down the runs.')
+@click.option('--csv', 'csv_path', type=click.Path(dir_okay=False, writable=True), help='Save the results to CSV.')
+@click.option('--json', 'json_path', type=click.Path(dir_okay=False, writable=True), help='Save the results to JSON.')
+def main(
+    verbosity: int,
+    n_heroes: Optional[int],
+    n_seeds: int,
+    exhaustive_max_teams: int,
+    overrides: List[str],
+    engines: List[str],
+    profile: bool,
+    trace_memory: bool,
+    csv_path: Optional[str],
+    json_path: Optional[str],
+):
+    """Benchmark the solver on the pre-dumped data."""
     bestmobabot.logging_.install_logging(verbosity)
+    settings = ArenaSettings(**dict(override.split('=', 1) for override in overrides))
 
     logger.info('Loading the dumps…')
     with Database(constants.DATABASE_NAME) as db:
-        model: Model = pickle.loads(b85decode(db['bot:model']))
+        model = load_model(db, compile_forest=settings.compile_forest)
     heroes: List[Hero] = pickle.loads((Path('dumps') / 'heroes.pkl').read_bytes())
     arena_enemies: List[ArenaEnemy] = pickle.loads((Path('dumps') / 'arena_enemies.pkl').read_bytes())
     grand_enemies: List[GrandArenaEnemy] = pickle.loads((Path('dumps') / 'grand_enemies.pkl').read_bytes())
+    if n_heroes is not None:
+        heroes = naive_select_attackers(heroes, n_heroes)
+    logger.info('{} heroes, {} possible teams.', len(heroes), comb(len(heroes), TEAM_SIZE))
 
-    logger.info('')
-    for enemy in arena_enemies:
-        solution = ArenaSolver(
-            db={},
-            model=model,
-            user_clan_id=None,
-            heroes=heroes,
-            n_required_teams=1,
-            max_iterations=0,
-            n_keep_solutions=50,
-            n_generate_solutions=100,
-            n_generations_count_down=25,
-            early_stop=0.95,
-            get_enemies=list,
-            friendly_clans=[],
-            reduce_probabilities=reduce_normal_arena,
-            callback=lambda: None,
-        ).initialize().solve_enemy(enemy)
-        logger.info('{}', solution)
+    normal_solver = partial(
+        ArenaSolver,
+        n_required_teams=1,
+        n_keep_solutions=settings.normal_keep_solutions,
+        n_generate_solutions=settings.normal_generate_solutions,
+        n_generations_count_down=settings.normal_generations_count_down,
+        reduce_probabilities=reduce_normal_arena,
+        enemy_time_limit=settings.normal_enemy_time_limit,
+        page_time_limit=settings.normal_page_time_limit,
+        engine=settings.normal_engine,
+    )
+    grand_solver = partial(
+        ArenaSolver,
+        n_required_teams=constants.N_GRAND_TEAMS,
+        n_keep_solutions=settings.grand_keep_solutions,
+        n_generate_solutions=settings.grand_generate_solutions,
+        n_generations_count_down=settings.grand_generations_count_down,
+        reduce_probabilities=reduce_grand_arena,
+        enemy_time_limit=settings.grand_enemy_time_limit,
+        page_time_limit=settings.grand_page_time_limit,
+        n_islands=settings.grand_islands,
+        migration_interval=settings.grand_migration_interval,
+        engine=settings.grand_engine,
+        assign_teams=settings.grand_assign_teams,
+    )
+    # The mode is either the engine or the exhaustive search.
+    normal_engines = [ArenaEngine(engine) for engine in engines] or [settings.normal_engine]
+    grand_engines = [ArenaEngine(engine) for engine in engines] or [settings.grand_engine]
+    modes = [
+        ('normal', engine.value, partial(normal_solver, engine=engine), arena_enemies, 0)
+        for engine in normal_engines
+    ]
+    if comb(len(heroes), TEAM_SIZE) <= exhaustive_max_teams:
+        modes.append(('normal', 'exhaustive', normal_solver, arena_enemies, exhaustive_max_teams))
+    modes.extend(
+        ('grand', engine.value, partial(grand_solver, engine=engine), grand_enemies, 0)
+        for engine in grand_engines
+    )
+
+    runs = []
+    for arena, mode, make_solver, enemies, max_teams in modes:
+        logger.info('')
+        for enemy, seed in product(enemies, range(n_seeds)):
+            solver = make_solver(
+                db={},
+                model=model,
+                user_clan_id=None,
+                heroes=heroes,
+                max_iterations=0,
+                early_stop=settings.early_stop,
+                get_enemies=list,
+                friendly_clans=[],
+                callback=lambda _: None,
+                seed=seed,
+                exhaustive_max_teams=max_teams,
+                profile=profile,
+                n_workers=settings.n_workers,
+            )
+            if trace_memory:
+                tracemalloc.start()
+            with solver.initialize().start_pool():
+                start_time = perf_counter()
+                # Each run is a page of a single enemy.
+                solution = solver.solve_enemy(enemy, solver.make_deadlines(1)[0])
+                elapsed = perf_counter() - start_time
+            if trace_memory:
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            logger.info('{} in {:.1f} s ({} {}, seed {}).', solution, elapsed, arena, mode, seed)
+            logger.debug('Stats: {}.', solution.stats)
+            runs.append({
+                'arena': arena,
+                'mode': mode,
+                'enemy': enemy.user_id,
+                'seed': seed,
+                'time': elapsed,
+                'n_generations': solution.stats.n_generations,
+                'n_rows': solution.stats.n_rows,
+                'n_timeouts': solution.stats.n_timeouts,
+                'n_best_rows': solution.stats.n_best_rows,
+                'probability': solution.probability,
+                **{f'time_{phase}': seconds for phase, seconds in solution.stats.timings.items()},
+                **({'peak_memory': peak_memory / 1048576.0} if trace_memory else {}),
+            })
 
+    results = summarize_runs(DataFrame(runs))
     logger.info('')
-    for enemy in grand_enemies:
-        solution = ArenaSolver(
-            db={},
-            model=model,
-            user_clan_id=None,
-            heroes=heroes,
-            n_required_teams=constants.N_GRAND_TEAMS,
-            max_iterations=0,
-            n_keep_solutions=50,
-            n_generate_solutions=500,
-            n_generations_count_down=50,
-            early_stop=0.95,
-            get_enemies=list,
-            friendly_clans=[],
-            reduce_probabilities=reduce_grand_arena,
-            callback=lambda: None,
-        ).initialize().solve_enemy(enemy)
-        logger.info('{}', solution)
+    formatters = {'probability_var': '{:.2e}'.format}
+    for line in results.to_string(index=False, float_format='{:.4f}'.format, formatters=formatters).splitlines():
+        logger.info('{}', line)
+    if csv_path:
+        results.to_csv(csv_path, index=False)
+    if json_path:
+        results.to_json(json_path, orient='records', indent=2)
+    logger.info('Maximum resident set size: {:.1f} MiB.', getrusage(RUSAGE_SELF).ru_maxrss / 1024.0)
+
+
+def summarize_runs(runs: DataFrame) -> DataFrame:
+    """
+    Aggregate the benchmark runs over the seeds for each enemy, and over all the enemies for each mode.
+    """
+    means = [column for column in runs.columns if column.startswith('time_') or column == 'peak_memory']
+    results = concat([runs, runs.assign(enemy='total')]).groupby(['arena', 'mode', 'enemy'], sort=False).agg(
+        n_runs=('seed', 'size'),
+        time=('time', 'sum'),
+        n_generations=('n_generations', 'mean'),
+        n_rows=('n_rows', 'sum'),
+        n_timeouts=('n_timeouts', 'sum'),
+        n_best_rows=('n_best_rows', 'mean'),
+        probability_mean=('probability', 'mean'),
+        probability_var=('probability', 'var'),
+        **{column: (column, 'mean') for column in means},
+    )
+    results['rows_per_second'] = results['n_rows'] / results['time']
+    results['time'] /= results['n_runs']
+    results['n_rows'] /= results['n_runs']
+    return results.reset_index()
 
 
 if __name__ == '__main__':
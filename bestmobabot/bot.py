@@ -1,6 +1,4 @@
 import calendar
-import pickle
-from base64 import b85decode
 from datetime import datetime, time, timedelta, timezone
 from operator import attrgetter
 from random import choice, shuffle
@@ -15,7 +13,7 @@ from bestmobabot.dataclasses_ import ArenaResult, Hero, Mission, Quest, Quests,
 from bestmobabot.enums import BattleType, TowerFloorType
 from bestmobabot.helpers import find_expedition_team, get_teams_unit_ids, get_unit_ids, naive_select_attackers
 from bestmobabot.logging_ import log_rewards, logger
-from bestmobabot.model import Model
+from bestmobabot.model import Model, load_model
 from bestmobabot.resources import get_heroic_mission_ids, mission_name, shop_name
 from bestmobabot.scheduler import Scheduler, Task, now
 from bestmobabot.settings import Settings
@@ -320,6 +318,7 @@ class Bot:
             self.db,
             n_splits=constants.MODEL_N_SPLITS,
             n_last_battles=self.settings.bot.arena.last_battles,
+            n_workers=self.settings.bot.arena.n_workers,
         ).train()
         self.log(f'🎲️ *{self.user.name}* натренировал модель.')
 
@@ -336,7 +335,7 @@ class Bot:
         # Load arena model.
         logger.info('Loading model…')
         try:
-            model: Model = pickle.loads(b85decode(self.db['bot:model']))
+            model = load_model(self.db, compile_forest=self.settings.bot.arena.compile_forest)
         except KeyError:
             logger.warning('Model is not ready yet.')
             return
@@ -394,6 +393,16 @@ class Bot:
                 friendly_clans=self.settings.bot.arena.friendly_clans,
                 reduce_probabilities=reduce_normal_arena,
                 callback=lambda i: self.log(f'⚔️ *{self.user.name}* на странице *{i}* обычной арены…'),
+                n_workers=self.settings.bot.arena.n_workers,
+                prefetch=self.settings.bot.arena.prefetch_enemies,
+                exhaustive_max_teams=self.settings.bot.arena.normal_exhaustive_max_teams,
+                user_id=self.user.id,
+                profile=self.settings.bot.arena.profile_solver,
+                screening_margin=self.settings.bot.arena.screening_margin,
+                enemy_time_limit=self.settings.bot.arena.normal_enemy_time_limit,
+                page_time_limit=self.settings.bot.arena.normal_page_time_limit,
+                halving_generations=self.settings.bot.arena.normal_halving_generations,
+                engine=self.settings.bot.arena.normal_engine,
             ),
             attack=lambda solution: self.api.attack_arena(solution.enemy.user_id, get_unit_ids(solution.attackers[0])),
             finalise=lambda: None,
@@ -421,6 +430,18 @@ class Bot:
                 friendly_clans=self.settings.bot.arena.friendly_clans,
                 reduce_probabilities=reduce_grand_arena,
                 callback=lambda i: self.log(f'⚔️ *{self.user.name}* на странице *{i}* гранд-арены…'),
+                n_workers=self.settings.bot.arena.n_workers,
+                prefetch=self.settings.bot.arena.prefetch_enemies,
+                user_id=self.user.id,
+                profile=self.settings.bot.arena.profile_solver,
+                screening_margin=self.settings.bot.arena.screening_margin,
+                enemy_time_limit=self.settings.bot.arena.grand_enemy_time_limit,
+                page_time_limit=self.settings.bot.arena.grand_page_time_limit,
+                halving_generations=self.settings.bot.arena.grand_halving_generations,
+                n_islands=self.settings.bot.arena.grand_islands,
+                migration_interval=self.settings.bot.arena.grand_migration_interval,
+                engine=self.settings.bot.arena.grand_engine,
+                assign_teams=self.settings.bot.arena.grand_assign_teams,
             ),
             attack=lambda solution: self.api.attack_grand(
                 solution.enemy.user_id, get_teams_unit_ids(solution.attackers)),
@@ -440,12 +461,14 @@ class Bot:
         for replay in replays:
             if f'replays:{replay.id}' in self.db:
                 continue
-            self.db[f'replays:{replay.id}'] = {
+            value = {
                 'start_time': replay.start_time.timestamp(),
                 'win': replay.result.win,
                 'attackers': [hero.dict() for hero in replay.attackers.values()],
                 'defenders': [hero.dict() for defenders in replay.defenders for hero in defenders.values()],
             }
+            self.db[f'replays:{replay.id}'] = value
+            Trainer.save_features(self.db, replay.id, value)
             logger.info(f'Saved #{replay.id}.')
 
         self.log(f'📒️ *{self.user.name}* прочитал журнал арены.')
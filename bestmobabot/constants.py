@@ -32,6 +32,16 @@ MODEL_PARAM_GRID = {
     'n_estimators': MODEL_N_ESTIMATORS_CHOICES,
 }
 MODEL_N_LAST_BATTLES = 20000
+MODEL_FEATURES_VERSION = 1  # bump on `Hero.features` changes, so that the stored battle features get re-parsed
+
+# Arena solver.
+ARENA_MEMO_SIZE = 200000  # maximum number of memoized single battle probabilities
+ARENA_EXHAUSTIVE_CHUNK_SIZE = 4096  # number of teams scored at once by the exhaustive search
+ARENA_N_MIGRANTS = 5  # number of the best solutions which migrate to the next island
+ARENA_ANNEALING_TEMPERATURE = 0.01  # initial temperature of the simulated annealing, in terms of probability
+ARENA_ANNEALING_COOLING = 0.95  # temperature factor per generation
+ARENA_ANNEALING_MIN_TEMPERATURE = 1e-9  # avoids division by zero once the temperature underflows
+FEATURES_CACHE_SIZE = 64  # number of cached hero feature matrices
 
 # Arena retries.
 ARENA_MIN_PROBABILITY = 0.5
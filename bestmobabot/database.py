@@ -4,6 +4,7 @@ Database wrapper.
 
 import json
 import sqlite3
+import threading
 from contextlib import AbstractContextManager, closing
 from typing import Any, Iterable, Iterator, MutableMapping, Tuple, TypeVar
 
@@ -14,8 +15,10 @@ T = TypeVar('T')
 
 class Database(AbstractContextManager, MutableMapping[str, Any]):
     def __init__(self, path: str):
-        self.connection = sqlite3.connect(path, isolation_level=None)
-        with closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+        # The connection may be shared with background threads, hence the lock.
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.lock = threading.RLock()
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS `default` (
                     `key` TEXT PRIMARY KEY NOT NULL,
@@ -23,27 +26,59 @@ class Database(AbstractContextManager, MutableMapping[str, Any]):
                     `modified_on` DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            # Large binary values, which would be too expensive to encode into JSON.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS `blob` (
+                    `key` TEXT PRIMARY KEY NOT NULL,
+                    `value` BLOB,
+                    `modified_on` DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
 
     def get_by_prefix(self, prefix: str) -> Iterable[Tuple[str, T]]:
         """
         Gets all values from the specified index.
         """
-        with closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
             cursor.execute("SELECT `key`, `value` FROM `default` WHERE `key` LIKE ? || '%'", (prefix,))
             return ((key, json.loads(value)) for key, value in cursor.fetchall())
 
+    def get_keys_by_prefix(self, prefix: str) -> Iterable[str]:
+        """
+        Gets all keys from the specified index without reading the values.
+        """
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+            cursor.execute("SELECT `key` FROM `default` WHERE `key` LIKE ? || '%'", (prefix,))
+            return [key for key, in cursor.fetchall()]
+
+    def get_blob(self, key: str) -> bytes:
+        logger.trace('get blob {}', key)
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+            cursor.execute('SELECT value FROM `blob` WHERE `key` = ?', (key,))
+            if row := cursor.fetchone():
+                return row[0]
+            raise KeyError(key)
+
+    def set_blob(self, key: str, value: bytes):
+        logger.trace('set blob {} ({} bytes)', key, len(value))
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+            cursor.execute('''
+                INSERT OR REPLACE INTO `blob` (`key`, `value`)
+                VALUES (?, ?)
+            ''', (key, value))
+
     def vacuum(self):
-        with closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
             cursor.execute('VACUUM')
 
     def __contains__(self, key: str) -> bool:
-        with closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
             cursor.execute('SELECT exists(SELECT 1 FROM `default` WHERE `key` = ?)', (key,))
             return bool(cursor.fetchone()[0])
 
     def __getitem__(self, key: str) -> Any:
         logger.trace('get {}', key)
-        with closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
             cursor.execute('SELECT value FROM `default` WHERE `key` = ?', (key,))
             if row := cursor.fetchone():
                 return json.loads(row[0])
@@ -51,7 +86,7 @@ class Database(AbstractContextManager, MutableMapping[str, Any]):
 
     def __setitem__(self, key: str, value: Any) -> None:
         logger.trace('set {} = {!s:.40}…', key, value)
-        with closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
             cursor.execute('''
                 INSERT OR REPLACE INTO `default` (`key`, `value`)
                 VALUES (?, ?)
@@ -61,7 +96,11 @@ class Database(AbstractContextManager, MutableMapping[str, Any]):
         raise NotImplementedError()
 
     def __delitem__(self, key: str) -> None:
-        raise NotImplementedError()
+        logger.trace('delete {}', key)
+        with self.lock, closing(self.connection.cursor()) as cursor:  # type: sqlite3.Cursor
+            cursor.execute('DELETE FROM `default` WHERE `key` = ?', (key,))
+            if not cursor.rowcount:
+                raise KeyError(key)
 
     def __iter__(self) -> Iterator[str]:
         raise NotImplementedError()
@@ -6,6 +6,12 @@ class BattleType(Enum):
     GRAND = 'grand'
 
 
+class ArenaEngine(Enum):
+    GENETIC = 'genetic'
+    ANNEALING = 'annealing'
+    CLIMBING = 'climbing'
+
+
 class HeroesJSMode(Enum):
     TITAN = 'titan'
     TOWER = 'tower'
@@ -0,0 +1,65 @@
+"""
+Hero feature vectorizer.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Tuple
+
+import numpy
+from numpy import ndarray
+
+from bestmobabot import constants
+from bestmobabot.dataclasses_ import Hero
+
+
+class Vectorizer:
+    """
+    Makes hero feature matrices with the model feature columns.
+    """
+
+    def __init__(self, feature_names: List[str]):
+        self.feature_names = feature_names
+        self.indices: Dict[str, int] = {name: i for i, name in enumerate(feature_names)}
+
+        # Matrices of the recently used hero lists. The least recently used ones get evicted.
+        self.cache: Dict[Tuple[str, ...], ndarray] = {}
+
+    @property
+    def n_features(self) -> int:
+        return len(self.feature_names)
+
+    def transform(self, heroes: Iterable[Hero]) -> ndarray:
+        """
+        Make heroes features 2D-array. Shape is number of heroes × number of features.
+        The result is cached by the heroes state and must not be modified.
+        """
+        heroes = list(heroes)
+        # Pydantic representation includes all the fields, and it's cheaper than the features themselves.
+        key = tuple(repr(hero) for hero in heroes)
+        if (x := self.cache.pop(key, None)) is not None:
+            self.cache[key] = x  # move to the end
+            return x
+
+        # Heroes have only a few features of many, thus scatter them into the zero matrix.
+        rows: List[int] = []
+        columns: List[int] = []
+        values: List[float] = []
+        for i, hero in enumerate(heroes):
+            for name, value in hero.features.items():
+                if (column := self.indices.get(name)) is not None:
+                    rows.append(i)
+                    columns.append(column)
+                    values.append(value)
+        x = numpy.zeros((len(heroes), self.n_features))
+        x[rows, columns] = values
+        x.flags.writeable = False
+
+        self.cache[key] = x
+        for _ in range(len(self.cache) - constants.FEATURES_CACHE_SIZE):
+            del self.cache[next(iter(self.cache))]
+        return x
+
+    def __getstate__(self):
+        # The cache is only useful in the current process.
+        return {**self.__dict__, 'cache': {}}
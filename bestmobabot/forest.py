@@ -0,0 +1,184 @@
+"""
+Compiled random forest evaluator.
+
+The forest gets flattened into contiguous node arrays once, so that a whole batch of samples
+could be pushed through all the trees at once, level by level.
+"""
+
+from __future__ import annotations
+
+import pickle
+from pathlib import Path
+from time import perf_counter
+from typing import List
+
+import click
+import numpy
+from loguru import logger
+from numpy import ndarray
+from sklearn.ensemble import RandomForestClassifier
+
+import bestmobabot.logging_
+from bestmobabot import constants
+from bestmobabot.constants import TEAM_SIZE
+from bestmobabot.database import Database
+from bestmobabot.dataclasses_ import ArenaEnemy, GrandArenaEnemy, Hero
+
+LEAF = -1  # scikit-learn marks missing children this way, we do the same for leaf features
+CHUNK_SIZE = 1024  # rows
+
+
+class Forest:
+    """
+    Flattened `RandomForestClassifier` which predicts the positive class probability.
+    """
+
+    def __init__(self, estimator: RandomForestClassifier):
+        if len(estimator.classes_) != 2:
+            raise ValueError(f'only binary classifiers are supported, got classes: {estimator.classes_}')
+
+        features: List[ndarray] = []
+        thresholds: List[ndarray] = []
+        children: List[ndarray] = []
+        values: List[ndarray] = []
+        roots: List[int] = []
+        offset = 0
+
+        for sub_estimator in estimator.estimators_:
+            tree = sub_estimator.tree_
+            order = breadth_first_order(tree.children_left, tree.children_right)
+
+            # Node indices are global across all the trees. In the breadth-first order siblings are adjacent,
+            # thus it's enough to store the left child index and add 1 to go right.
+            new_indices = numpy.empty(tree.node_count, dtype=numpy.intp)
+            new_indices[order] = numpy.arange(offset, offset + tree.node_count)
+            is_leaf = tree.children_left[order] == LEAF
+            roots.append(offset)
+            features.append(numpy.where(is_leaf, LEAF, tree.feature[order]))
+            thresholds.append(tree.threshold[order])
+            children.append(numpy.where(is_leaf, LEAF, new_indices[tree.children_left[order]]))
+
+            # Normalize leaf values to probabilities the same way `DecisionTreeClassifier.predict_proba` does.
+            value = tree.value[order, 0, :]
+            normalizer = value.sum(axis=1)
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(value[:, 1] / normalizer)
+            offset += tree.node_count
+
+        self.roots = numpy.array(roots, dtype=numpy.intp)
+        self.features = numpy.concatenate(features).astype(numpy.intp)  # `LEAF` for leaves
+        self.thresholds = numpy.concatenate(thresholds).astype(numpy.float64)
+        self.children = numpy.concatenate(children).astype(numpy.intp)  # left child index
+        self.values = numpy.concatenate(values)  # positive class probability
+
+    @property
+    def n_trees(self) -> int:
+        return self.roots.size
+
+    @property
+    def n_nodes(self) -> int:
+        return self.features.size
+
+    def predict_proba(self, x: ndarray) -> ndarray:
+        """
+        Predicts the positive class probability for each row of `x`.
+        """
+        # Smaller chunks keep the working set in the CPU cache.
+        return numpy.concatenate([
+            self.predict_chunk(x[start:start + CHUNK_SIZE])
+            for start in range(0, len(x), CHUNK_SIZE)
+        ]) if len(x) else numpy.zeros(0)
+
+    def predict_chunk(self, x: ndarray) -> ndarray:
+        n_rows = x.shape[0]
+        result = numpy.zeros(n_rows)
+
+        # Scikit-learn compares `float32` features against `float64` thresholds, so should we.
+        # Transposing makes the same feature of the neighbouring rows adjacent in memory.
+        x_transposed = numpy.ascontiguousarray(x.T, dtype=numpy.float32).ravel()
+
+        # Each (tree, row) pair is a "cursor" which descends from the root until it reaches a leaf.
+        rows = numpy.tile(numpy.arange(n_rows), self.n_trees)
+        nodes = numpy.repeat(self.roots, n_rows)
+
+        while nodes.size:
+            features = self.features[nodes]
+            is_leaf = features == LEAF
+            if is_leaf.any():
+                # Collect the finished cursors and continue with the rest only.
+                result += numpy.bincount(rows[is_leaf], weights=self.values[nodes[is_leaf]], minlength=n_rows)
+                is_active = ~is_leaf
+                rows = rows[is_active]
+                nodes = nodes[is_active]
+                features = features[is_active]
+            nodes = self.children[nodes] + (x_transposed[features * n_rows + rows] > self.thresholds[nodes])
+
+        return result / self.n_trees
+
+
+def breadth_first_order(children_left: ndarray, children_right: ndarray) -> ndarray:
+    """
+    Get node indices in the breadth-first order.
+    """
+    order = [0]
+    for node in order:  # the list grows while we iterate over it
+        if children_left[node] != LEAF:
+            order.append(children_left[node])
+            order.append(children_right[node])
+    return numpy.array(order, dtype=numpy.intp)
+
+
+# Benchmark.
+# ----------------------------------------------------------------------------------------------------------------------
+
+@click.command()
+@click.option('verbosity', '-v', '--verbose', count=True, help='Increase verbosity.')
+@click.option('--n-rows', type=int, multiple=True, default=[150, 1500], help='Batch sizes.', show_default=True)
+@click.option('--n-repeats', type=int, default=10, help='Number of timed runs per batch.', show_default=True)
+def main(verbosity: int, n_rows: List[int], n_repeats: int):
+    """Compare the compiled forest against scikit-learn on the pre-dumped data."""
+    from bestmobabot.model import load_model  # the model module depends on this one
+
+    bestmobabot.logging_.install_logging(verbosity)
+
+    logger.info('Loading the dumps…')
+    with Database(constants.DATABASE_NAME) as db:
+        model = load_model(db)
+    heroes: List[Hero] = pickle.loads((Path('dumps') / 'heroes.pkl').read_bytes())
+    arena_enemies: List[ArenaEnemy] = pickle.loads((Path('dumps') / 'arena_enemies.pkl').read_bytes())
+    grand_enemies: List[GrandArenaEnemy] = pickle.loads((Path('dumps') / 'grand_enemies.pkl').read_bytes())
+
+    logger.info('Compiling the forest…')
+    start_time = perf_counter()
+    forest = Forest(model.estimator)
+    logger.info('Compiled {} nodes in {:.3f} s.', forest.n_nodes, perf_counter() - start_time)
+
+    # Make up random attacker teams against the dumped defender teams, just like the solver does.
+    hero_features = model.make_features(heroes)
+    defenders_features = [
+        model.make_features(team).sum(axis=0)
+        for enemy in [*arena_enemies, *grand_enemies]
+        for team in enemy.teams
+    ]
+    random_state = numpy.random.RandomState(42)
+
+    for n in n_rows:
+        x = numpy.vstack([
+            hero_features[random_state.randint(0, len(heroes), (n, TEAM_SIZE))].sum(axis=1) - defender_features
+            for defender_features in defenders_features
+        ])
+        expected = model.estimator.predict_proba(x)[:, 1]
+        actual = forest.predict_proba(x)
+        logger.info('{} rows: max absolute error is {:.2e}.', len(x), numpy.abs(expected - actual).max())
+
+        engines = [('scikit-learn', model.estimator.predict_proba), ('compiled', forest.predict_proba)]
+        for name, predict_proba in engines:
+            start_time = perf_counter()
+            for _ in range(n_repeats):
+                predict_proba(x)
+            elapsed = (perf_counter() - start_time) / n_repeats
+            logger.info('{} rows, {}: {:.1f} ms ({:.0f} rows/s).', len(x), name, 1000.0 * elapsed, len(x) / elapsed)
+
+
+if __name__ == '__main__':
+    main()
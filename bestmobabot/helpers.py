@@ -1,13 +1,18 @@
 from __future__ import annotations
 
-from itertools import combinations
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import combinations, cycle
 from operator import attrgetter
-from typing import Iterable, List, Optional, Sequence, TypeVar
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from loguru import logger
 
 from bestmobabot import constants
 from bestmobabot.dataclasses_ import Hero, Unit
 
 TUnit = TypeVar('TUnit', bound=Unit)
+T = TypeVar('T')
 
 
 def get_unit_ids(team: Iterable[TUnit]) -> List[str]:
@@ -42,3 +47,68 @@ def find_expedition_team(heroes: Iterable[Hero], min_power: int) -> Optional[Seq
             best_team = team
 
     return best_team
+
+
+# Worker processes.
+# ----------------------------------------------------------------------------------------------------------------------
+
+# Each worker process receives the state once at start, for example the solver along with the model.
+worker_state: Tuple[Any, ...] = ()
+
+
+def initialize_worker(*state: Any):
+    global worker_state
+    worker_state = state
+
+
+def get_worker_state() -> Tuple[Any, ...]:
+    return worker_state
+
+
+class WorkerPool:
+    """
+    Worker processes, each with its own executor. Unlike a plain process pool, jobs may be sent to a specific worker,
+    so that the state the worker keeps between the jobs gets reused.
+    """
+
+    def __init__(self, executors: List[Executor]):
+        self.executors = executors
+
+    def __len__(self) -> int:
+        return len(self.executors)
+
+    def map(
+        self,
+        function: Callable[..., T],
+        *iterables: Iterable[Any],
+        workers: Optional[Iterable[int]] = None,
+    ) -> Iterator[T]:
+        """
+        Like `Executor.map`. The jobs go to the workers in turn, unless the worker indices are specified.
+        """
+        if workers is None:
+            workers = cycle(range(len(self.executors)))
+        futures = [self.executors[worker].submit(function, *args) for worker, args in zip(workers, zip(*iterables))]
+        return (future.result() for future in futures)
+
+
+@contextmanager
+def start_workers(n_workers: int, *state: Any) -> Iterator[Optional[WorkerPool]]:
+    """
+    Keep the worker processes running while in the context, unless there's the only worker.
+    Each worker process receives the state once at start, see `get_worker_state`.
+    """
+    if n_workers == 1:
+        yield None
+        return
+    logger.debug('Starting {} worker processes…', n_workers)
+    with ExitStack() as stack:
+        executors = [
+            stack.enter_context(ProcessPoolExecutor(1, initializer=initialize_worker, initargs=state))
+            for _ in range(n_workers)
+        ]
+        # The processes start on the first job. Start them right away, before the caller starts any threads,
+        # because a process forked along with a running thread may inherit a lock which is never released.
+        for future in [executor.submit(int) for executor in executors]:
+            future.result()
+        yield WorkerPool(executors)
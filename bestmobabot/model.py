@@ -1,30 +1,114 @@
+from __future__ import annotations
+
 import pickle
-from base64 import b85encode
+import tracemalloc
+from base64 import b85decode, b85encode
 from collections import defaultdict
-from itertools import product
+from copy import copy
+from functools import partial
+from io import BytesIO
+from itertools import compress, product
+from math import ceil
 from operator import itemgetter
-from typing import Any, DefaultDict, Dict, Iterable, List, NamedTuple, Optional
+from time import perf_counter
+from typing import Any, DefaultDict, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from uuid import uuid4
 
+import click
+import joblib
 import numpy
 from loguru import logger
-from pandas import DataFrame, Series
 from scipy import stats
+from scipy.sparse import csr_matrix
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import StratifiedKFold, cross_val_score
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import StratifiedKFold
 
+import bestmobabot.logging_
 from bestmobabot import constants, dataclasses_
 from bestmobabot.database import Database
+from bestmobabot.features import Vectorizer
+from bestmobabot.forest import Forest
+from bestmobabot.helpers import get_worker_state, start_workers
 
 
 class Model(NamedTuple):
     estimator: RandomForestClassifier
     feature_names: List[str]
+    forest: Optional[Forest] = None  # compiled estimator, it's not pickled by the trainer
+    vectorizer: Optional[Vectorizer] = None  # it's not pickled by the trainer either
+
+    def compile(self, *, forest: bool = False) -> Model:
+        """
+        Index the features for the faster predictions. Call it once after loading the model.
+        Flattening the estimator is opt-in: it's only faster than scikit-learn for some forests and batch sizes.
+        """
+        return self._replace(
+            forest=Forest(self.estimator) if forest else None,
+            vectorizer=Vectorizer(self.feature_names),
+        )
+
+    def make_features(self, heroes: Iterable[dataclasses_.Hero]) -> numpy.ndarray:
+        """
+        Make heroes features 2D-array. Uses the compiled vectorizer if available.
+        """
+        return (self.vectorizer or Vectorizer(self.feature_names)).transform(heroes)
+
+    def predict_proba(self, x: numpy.ndarray) -> numpy.ndarray:
+        """
+        Predicts win probabilities. Uses the compiled forest if available.
+        """
+        if self.forest is not None:
+            return self.forest.predict_proba(x)
+        return self.estimator.predict_proba(x)[:, 1]
+
+
+# Model storage.
+# ----------------------------------------------------------------------------------------------------------------------
+
+# The compiled model of the current process along with its version and whether the forest is flattened.
+# It gets replaced once the trainer saves a new one.
+cached_model: Optional[Tuple[str, bool, Model]] = None
+
+
+def save_model(db: Database, model: Model):
+    """
+    Save the model as a binary blob and bump its version, so that the bots would reload it.
+    The legacy model gets deleted, since it's never loaded once the version is set.
+    """
+    buffer = BytesIO()
+    joblib.dump(model, buffer)  # numpy arrays of the trees are written as is, without pickling them
+    db.set_blob('bot:model', buffer.getvalue())
+    db['bot:model:version'] = uuid4().hex  # written last, so that the version never points to an older model
+    if 'bot:model' in db:
+        del db['bot:model']
+
+
+def load_model(db: Database, *, compile_forest: bool = False) -> Model:
+    """
+    Load the compiled model. The cached one is reused unless the trainer has saved a newer version.
+    Falls back to the legacy model which is stored in the database as the encoded pickle.
+    Raises `KeyError` if there's no model yet.
+    """
+    global cached_model
+
+    if (version := db.get('bot:model:version')) is None:
+        logger.debug('Loading the legacy model…')
+        return pickle.loads(b85decode(db['bot:model'])).compile(forest=compile_forest)
+    if cached_model is None or cached_model[:2] != (version, compile_forest):
+        logger.debug('Loading model {}…', version)
+        model = joblib.load(BytesIO(db.get_blob('bot:model'))).compile(forest=compile_forest)
+        cached_model = (version, compile_forest, model)
+    return cached_model[2]
 
 
 class Trainer:
-    def __init__(self, db: Database, *, n_splits: int, n_last_battles: int):
+    def __init__(self, db: Database, *, n_splits: int, n_last_battles: int, n_workers: int = 1):
         self.db = db
         self.n_splits = n_splits
+        self.n_workers = n_workers
         self.n_last_battles = n_last_battles
 
     def train(self):
@@ -38,21 +122,24 @@ class Trainer:
         if not battle_list:
             logger.info('There are no battles. Wait until someone attacks you.')
             return
-        battles = DataFrame(battle_list).fillna(value=0.0)
-        logger.info(f'Battles shape: {battles.shape}.')
-
-        # Split into X and y.
-        x: DataFrame = battles.drop(['win'], axis=1)
-        y: Series = battles['win']
-        value_counts: DataFrame = y.value_counts()
-        logger.info(f'Wins: {value_counts[False]}. Losses: {value_counts[True]}.')
+        # Battles have only a few non-zero features of thousands, thus keep them sparse.
+        y = numpy.array([battle.pop('win') for battle in battle_list], dtype=bool)
+        vectorizer = DictVectorizer(dtype=numpy.float32)
+        x: csr_matrix = vectorizer.fit_transform(battle_list)
+        x.eliminate_zeros()  # opposite heroes may cancel each other's features out
+        feature_names: List[str] = vectorizer.feature_names_
+        logger.info(f'Battles shape: {x.shape}, {x.nnz} non-zero features.')
+        n_wins = numpy.count_nonzero(y)
+        logger.info(f'Wins: {n_wins}. Losses: {len(y) - n_wins}.')
 
         # Here's our model.
         estimator = RandomForestClassifier(class_weight='balanced', n_jobs=-1)
 
         # Search for hyper-parameters if not explicitly set.
         params = self.search_hyper_parameters(
-            x, y, estimator, constants.MODEL_PARAM_GRID, StratifiedKFold(n_splits=self.n_splits, shuffle=True))
+            x, y, estimator, constants.MODEL_PARAM_GRID, StratifiedKFold(n_splits=self.n_splits, shuffle=True),
+            n_workers=self.n_workers,
+        )
 
         # Re-train the best model on the entire data.
         logger.info(f'Refitting with params: {params}…')
@@ -61,15 +148,12 @@ class Trainer:
             raise RuntimeError(f'unexpected classes: {estimator.classes_}')
 
         # Print debugging info.
-        for column, importance in sorted(zip(x.columns, estimator.feature_importances_), key=itemgetter(1), reverse=True):  # noqa
+        for column, importance in sorted(zip(feature_names, estimator.feature_importances_), key=itemgetter(1), reverse=True):  # noqa
             if importance > 0.0001:
                 logger.trace(f'Feature {column}: {importance:.4f}')
 
         logger.info('Saving model…')
-        self.db['bot:model'] = b85encode(pickle.dumps(
-            Model(estimator, list(x.columns)),
-            protocol=pickle.HIGHEST_PROTOCOL,
-        )).decode()
+        save_model(self.db, Model(estimator, feature_names))
 
         logger.info('Optimizing database…')
         self.db.vacuum()
@@ -77,15 +161,24 @@ class Trainer:
         logger.info('Finished.')
 
     @staticmethod
-    def search_hyper_parameters(x, y, estimator, param_grid, cv) -> Dict:
+    def search_hyper_parameters(x, y, estimator, param_grid, cv, *, n_workers: int = 1) -> Dict:
         logger.info('Searching for the best hyper-parameters…')
         search_cv = TTestSearchCV(
-            estimator, param_grid, cv=cv, scoring=constants.MODEL_SCORING, alpha=constants.MODEL_SCORING_ALPHA)
+            estimator,
+            param_grid,
+            cv=cv,
+            scoring=constants.MODEL_SCORING,
+            alpha=constants.MODEL_SCORING_ALPHA,
+            n_workers=n_workers,
+        )
 
         try:
             search_cv.fit(x, y)
         except KeyboardInterrupt:
-            pass  # allow stopping the process
+            # Allow stopping the process, unless there's nothing to choose from yet.
+            if search_cv.best_params_ is None:
+                logger.warning('Interrupted before any candidate has been scored on all the folds.')
+                raise
 
         score_interval = search_cv.best_confidence_interval_
         logger.info(f'Best score: {search_cv.best_score_:.4f} ({score_interval[0]:.4f} … {score_interval[1]:.4f})')
@@ -95,12 +188,33 @@ class Trainer:
 
     def read_battles(self) -> Iterable[Dict[str, Any]]:
         logger.info('Selecting battles…')
-        values = [value for _, value in self.db.get_by_prefix('replays:')]
+        prefix = self.get_features_key('')
+        rows: Dict[str, Dict[str, Any]] = {key[len(prefix):]: value for key, value in self.db.get_by_prefix(prefix)}
+
+        # Replays saved before the feature rows were introduced or with the other features version.
+        missing_keys = [key for key in self.db.get_keys_by_prefix('replays:') if key[len('replays:'):] not in rows]
+        if missing_keys:
+            logger.info(f'Parsing {len(missing_keys)} new battles…')
+            for key in missing_keys:
+                replay_id = key[len('replays:'):]
+                rows[replay_id] = self.save_features(self.db, replay_id, self.db[key])
+
         logger.info('Sorting battles…')
-        values.sort(key=lambda value: value.get('start_time', 0.0))
-        values = values[-self.n_last_battles:]
-        logger.info('Parsing battles…')
-        return [self.parse_battle(value) for value in values]
+        values = sorted(rows.values(), key=itemgetter('start_time'))
+        return [value['battle'] for value in values[-self.n_last_battles:]]
+
+    @classmethod
+    def save_features(cls, db: Database, replay_id: str, replay: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parse the replay and store its feature row, so that training wouldn't need to parse it again.
+        """
+        row = {'start_time': replay.get('start_time', 0.0), 'battle': cls.parse_battle(replay)}
+        db[cls.get_features_key(replay_id)] = row
+        return row
+
+    @staticmethod
+    def get_features_key(replay_id: str) -> str:
+        return f'features:{constants.MODEL_FEATURES_VERSION}:{replay_id}'
 
     @staticmethod
     def deduplicate_battles(battles: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -122,12 +236,17 @@ class Trainer:
 
 
 class TTestSearchCV:
-    def __init__(self, estimator, param_grid, *, cv, scoring, alpha=0.95):
+    """
+    Random forest hyper-parameters search which switches to the new parameters only if they're significantly better.
+    """
+
+    def __init__(self, estimator, param_grid, *, cv, scoring, alpha=0.95, n_workers=1):
         self.estimator = estimator
         self.param_grid: Dict[str, Any] = param_grid
         self.cv = cv
         self.scoring = scoring
         self.alpha = alpha
+        self.n_workers = n_workers
 
         self.p = 1.0 - alpha
         self.best_params_: Optional[Dict[str, Any]] = None
@@ -136,11 +255,7 @@ class TTestSearchCV:
         self.best_confidence_interval_: Optional[numpy.ndarray] = None
 
     def fit(self, x, y):
-        for values in product(*self.param_grid.values()):
-            params = dict(zip(self.param_grid.keys(), values))
-            self.estimator.set_params(**params)
-            logger.trace(f'CV started: {params}')
-            scores: numpy.ndarray = cross_val_score(self.estimator, x, y, scoring=self.scoring, cv=self.cv)
+        for params, scores in self.cross_validate(x, y):
             score: float = scores.mean()
             logger.debug(f'Score: {score:.4f} with {params}.')
             if not self.is_better_score(score, scores):
@@ -156,6 +271,122 @@ class TTestSearchCV:
                 scale=stats.sem(scores),
             )
 
+    def cross_validate(self, x, y) -> Iterable[Tuple[Dict[str, Any], numpy.ndarray]]:
+        """
+        Yields the cross-validation scores for each of the parameter combinations which survived the elimination.
+
+        The folds are scored in rounds of parallel (parameters, fold) jobs. After each round, the candidates
+        which are already significantly worse than the leader are eliminated and not scored on the rest of the folds.
+        In the last round, each candidate is yielded as soon as its last fold gets scored.
+
+        Forest with N trees is just the first N trees of a bigger forest. Thus, only the biggest surviving forest
+        gets fitted for each fold, and the smaller ones are its prefixes. `n_estimators` is iterated over the innermost.
+        """
+        param_grid = dict(self.param_grid)
+        n_estimators_choices: List[Optional[int]] = param_grid.pop('n_estimators', [None])
+        groups = [dict(zip(param_grid.keys(), values)) for values in product(*param_grid.values())]
+        candidates = [
+            {**params, 'n_estimators': n_estimators} if n_estimators is not None else params
+            for params in groups
+            for n_estimators in n_estimators_choices
+        ]
+        splits = list(self.cv.split(x, y))
+        # Seed each job in advance, so that the scores don't depend on which process gets the job.
+        random_states = numpy.random.randint(numpy.iinfo(numpy.int32).max, size=(len(groups), len(splits)))
+
+        scores: List[List[float]] = [[] for _ in candidates]
+        is_alive = numpy.ones((len(groups), len(n_estimators_choices)), dtype=bool)
+        n_done = 0
+
+        with start_workers(self.n_workers, self, x, y) as pool:
+            while n_done < len(splits):
+                alive_groups = numpy.flatnonzero(is_alive.any(axis=1))
+                # Keep all the workers busy, and score at least two folds to be able to run the t-test.
+                n_folds = max(2, ceil(self.n_workers / len(alive_groups)))
+                folds = range(n_done, min(n_done + n_folds, len(splits)))
+                logger.trace(f'Scoring folds {folds.start + 1}…{folds.stop} of {int(is_alive.sum())} candidates…')
+
+                keys = [(i, j) for i in alive_groups for j in folds]
+                jobs = [
+                    (
+                        groups[i],
+                        list(compress(n_estimators_choices, is_alive[i])),
+                        *splits[j],
+                        random_states[i, j],
+                    )
+                    for i, j in keys
+                ]
+                if pool is not None:
+                    results = pool.map(score_fold_in_worker, jobs)
+                else:
+                    results = (self.score_fold(x, y, *job) for job in jobs)
+                for (i, j), job_scores in zip(keys, results):
+                    for k, score in zip(numpy.flatnonzero(is_alive[i]), job_scores):
+                        scores[i * len(n_estimators_choices) + k].append(score)
+                    if j + 1 == len(splits):
+                        # The group is scored on all the folds, no need to wait for the other ones.
+                        for k in numpy.flatnonzero(is_alive[i]):
+                            index = i * len(n_estimators_choices) + k
+                            yield candidates[index], numpy.array(scores[index])
+
+                n_done = folds.stop
+                if n_done < len(splits):
+                    self.eliminate(candidates, scores, is_alive.reshape(-1))
+
+    def score_fold(
+        self,
+        x,
+        y,
+        params: Dict[str, Any],
+        n_estimators_choices: List[Optional[int]],
+        train: numpy.ndarray,
+        test: numpy.ndarray,
+        random_state: int,
+    ) -> List[float]:
+        """
+        Fits the estimator on the training part of the fold and scores each of the forest sizes on the test part.
+        """
+        estimator = clone(self.estimator).set_params(**params)
+        if estimator.random_state is None:
+            estimator.set_params(random_state=random_state)
+        if self.n_workers != 1:
+            estimator.set_params(n_jobs=1)  # the worker processes already occupy the CPUs
+        if None not in n_estimators_choices:
+            estimator.set_params(n_estimators=max(n_estimators_choices))
+        estimator.fit(x[train], y[train])
+
+        scorer = get_scorer(self.scoring)
+        x_test, y_test = x[test], y[test]
+        return [scorer(self.make_prefix(estimator, n), x_test, y_test) for n in n_estimators_choices]
+
+    @staticmethod
+    def make_prefix(estimator, n_estimators: Optional[int]):
+        """
+        Makes the forest of the first `n_estimators` trees of the fitted one.
+        """
+        if n_estimators is None:
+            return estimator
+        prefix = copy(estimator)
+        prefix.estimators_ = estimator.estimators_[:n_estimators]
+        prefix.n_estimators = n_estimators
+        return prefix
+
+    def eliminate(self, candidates: List[Dict[str, Any]], scores: List[List[float]], is_alive: numpy.ndarray):
+        """
+        Eliminates the candidates which partial scores are significantly worse than the leader's ones.
+        """
+        means = numpy.full(len(scores), -numpy.inf)
+        for i in numpy.flatnonzero(is_alive):
+            means[i] = numpy.mean(scores[i])
+        leader = int(numpy.argmax(means))
+        for i in numpy.flatnonzero(is_alive):
+            if means[i] >= means[leader]:
+                continue
+            _, p_value = stats.ttest_ind(scores[leader], scores[i])
+            if p_value < self.p:
+                logger.debug(f'Eliminated {candidates[i]} with score {means[i]:.4f} after {len(scores[i])} folds.')
+                is_alive[i] = False
+
     def is_better_score(self, score: float, scores: numpy.ndarray) -> bool:
         if self.best_params_ is None:
             return True
@@ -164,3 +395,69 @@ class TTestSearchCV:
         _, p_value = stats.ttest_ind(self.best_scores_, scores)
         logger.trace(f'P-value: {p_value:.4f}.')
         return p_value < self.p
+
+
+# Worker processes.
+# ----------------------------------------------------------------------------------------------------------------------
+
+def score_fold_in_worker(job: Tuple[Any, ...]) -> List[float]:
+    # Each worker process receives the search and the training data once at start.
+    search_cv, x, y = get_worker_state()
+    return search_cv.score_fold(x, y, *job)
+
+
+# Benchmark.
+# ----------------------------------------------------------------------------------------------------------------------
+
+@click.command()
+@click.option('verbosity', '-v', '--verbose', count=True, help='Increase verbosity.')
+@click.option('--n-repeats', type=int, default=5, help='Number of timed loads per storage.', show_default=True)
+def main(verbosity: int, n_repeats: int):
+    """Compare the legacy and the binary model storage on the current model."""
+    bestmobabot.logging_.install_logging(verbosity)
+
+    logger.info('Loading the model…')
+    with Database(constants.DATABASE_NAME) as db:
+        model = load_model(db)
+    model = Model(model.estimator, model.feature_names)  # the trainer saves the model uncompiled
+
+    # Scratch databases with either of the storages, the real one must not be touched.
+    legacy_db = Database(':memory:')
+    legacy_db['bot:model'] = b85encode(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)).decode()
+    binary_db = Database(':memory:')
+    save_model(binary_db, model)
+    logger.info(
+        '{} trees: legacy is {:.1f} MiB, binary is {:.1f} MiB.',
+        len(model.estimator.estimators_),
+        len(legacy_db['bot:model']) / 1048576.0,
+        len(binary_db.get_blob('bot:model')) / 1048576.0,
+    )
+
+    def load_uncached():
+        global cached_model
+        cached_model = None
+        return load_model(binary_db)
+
+    storages = [
+        ('legacy', partial(load_model, legacy_db)),
+        ('binary', load_uncached),
+        ('cached', partial(load_model, binary_db)),
+    ]
+    for name, load in storages:
+        start_time = perf_counter()
+        for _ in range(n_repeats):
+            load()
+        elapsed = (perf_counter() - start_time) / n_repeats
+
+        tracemalloc.start()
+        loaded_model = load()  # noqa: F841, it's kept alive until the memory is measured
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logger.info(
+            '{}: {:.1f} ms, {:.1f} MiB allocated, {:.1f} MiB at peak.',
+            name, 1000.0 * elapsed, current_memory / 1048576.0, peak_memory / 1048576.0,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ import yaml
 from pydantic import BaseModel, ValidationError, confloat, conint, validator
 
 from bestmobabot import constants
+from bestmobabot.enums import ArenaEngine
 
 
 class WebSettings(BaseModel):
@@ -26,19 +27,36 @@ class ArenaSettings(BaseModel):
     schedule_offset: timedelta = timedelta()  # arena task schedule offset
     friendly_clans: Set[str] = []  # names or clan IDs which must be skipped during enemy search
     early_stop: confloat(ge=0.0, le=1.0) = 0.95  # minimal win probability to stop enemy search
+    compile_forest: bool = False  # predict with the flattened forest instead of scikit-learn
     last_battles: conint(ge=1) = constants.MODEL_N_LAST_BATTLES  # use last N battles for training
+    n_workers: conint(ge=1) = 1  # number of processes to solve enemies of the same page and to train the model
+    prefetch_enemies: bool = False  # fetch the next enemy page while solving the current one
+    profile_solver: bool = False  # measure time spent in each solver phase
+    screening_margin: Optional[confloat(ge=0.0, le=1.0)] = None  # skip enemies which are hopeless after screening
 
     # Normal arena.
     normal_max_pages: conint(ge=1) = 15  # maximal number of pages during normal enemy search
     normal_generations_count_down: conint(ge=1) = 25
     normal_generate_solutions: conint(ge=1) = 100
     normal_keep_solutions: conint(ge=1) = 50
+    normal_exhaustive_max_teams: conint(ge=0) = 100000  # score all the teams if there are not more of them
+    normal_enemy_time_limit: Optional[confloat(gt=0.0)] = None  # seconds per enemy
+    normal_page_time_limit: Optional[confloat(gt=0.0)] = None  # seconds per enemy page
+    normal_halving_generations: Optional[conint(ge=1)] = None  # successive halving of the page enemies
+    normal_engine: ArenaEngine = ArenaEngine.GENETIC  # search strategy
 
     # Grand arena.
     grand_max_pages: conint(ge=1) = 15  # maximal number of pages during grand enemy search
     grand_generations_count_down: conint(ge=1) = 50  # maximum number of GA iterations without any improvement
     grand_generate_solutions: conint(ge=1) = 500
     grand_keep_solutions: conint(ge=1) = 50
+    grand_enemy_time_limit: Optional[confloat(gt=0.0)] = None  # seconds per enemy
+    grand_page_time_limit: Optional[confloat(gt=0.0)] = None  # seconds per enemy page
+    grand_halving_generations: Optional[conint(ge=1)] = None  # successive halving of the page enemies
+    grand_islands: conint(ge=1) = 1  # number of populations evolved against each enemy
+    grand_migration_interval: conint(ge=1) = 10  # number of generations between migrations
+    grand_engine: ArenaEngine = ArenaEngine.GENETIC  # search strategy
+    grand_assign_teams: bool = False  # assign the attacker teams to the defender teams optimally
     randomize_grand_defenders: bool = False
 
 
@@ -24,7 +24,14 @@ from bestmobabot.model import Trainer
     help='Use N last battles for training.',
     show_default=True,
 )
-def main(verbosity: int, n_splits: int, n_last_battles: int):
+@click.option(
+    '--n-workers',
+    type=int,
+    default=1,
+    help='Number of processes to score the hyper-parameters in parallel.',
+    show_default=True,
+)
+def main(verbosity: int, n_splits: int, n_last_battles: int, n_workers: int):
     """
     Train and generate arena prediction model.
     """
@@ -33,7 +40,7 @@ def main(verbosity: int, n_splits: int, n_last_battles: int):
         warnings.simplefilter('ignore')
 
     with Database(constants.DATABASE_NAME) as db:
-        Trainer(db, n_splits=n_splits, n_last_battles=n_last_battles).train()
+        Trainer(db, n_splits=n_splits, n_last_battles=n_last_battles, n_workers=n_workers).train()
 
 
 if __name__ == '__main__':
@@ -27,6 +27,7 @@ setuptools.setup(
         'scikit-learn',
         'scipy',
         'ipython',
+        'joblib',
         'loguru',
         'beautifulsoup4',
     ],
@@ -0,0 +1,462 @@
+from __future__ import annotations
+
+from itertools import combinations, count, permutations, product
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import patch
+
+import numpy
+import pytest
+from pandas import DataFrame
+from sklearn.ensemble import RandomForestClassifier
+
+from bestmobabot import constants
+from bestmobabot.arena import (
+    ArenaSolution,
+    ArenaSolver,
+    PhaseTimer,
+    SolverStats,
+    TeamMemo,
+    find_unique_offspring,
+    make_battle_features,
+    make_swaps,
+    reduce_at_least,
+    reduce_grand_arena,
+    reduce_normal_arena,
+    summarize_runs,
+    swap_heroes,
+)
+from bestmobabot.constants import TEAM_SIZE
+from bestmobabot.dataclasses_ import ArenaEnemy, GrandArenaEnemy, Hero, User
+from bestmobabot.enums import ArenaEngine
+from bestmobabot.itertools_ import slices
+from bestmobabot.model import Model
+
+
+def make_solver(**kwargs: Any) -> ArenaSolver:
+    return ArenaSolver(**{
+        'db': {},
+        'model': Model(estimator=None, feature_names=[]),
+        'user_clan_id': None,
+        'heroes': [],
+        'n_required_teams': 1,
+        'max_iterations': 1,
+        'n_keep_solutions': 10,
+        'n_generate_solutions': 10,
+        'n_generations_count_down': 5,
+        'early_stop': 0.95,
+        'get_enemies': list,
+        'friendly_clans': [],
+        'reduce_probabilities': reduce_normal_arena,
+        'callback': lambda _: None,
+        **kwargs,
+    })
+
+
+def make_grand_solver(**kwargs: Any) -> ArenaSolver:
+    """
+    Make the grand arena solver with a tiny model fitted on random battles.
+    """
+    random_state = numpy.random.RandomState(42)
+    heroes = [Hero(id=str(i), level=random_state.randint(1, 100), star=3, color=4, power=i) for i in range(20)]
+    feature_names = sorted(heroes[0].features)
+    x = random_state.uniform(-100.0, 100.0, (200, len(feature_names)))
+    estimator = RandomForestClassifier(n_estimators=5, random_state=42).fit(x, x[:, 0] > 0.0)
+    return make_solver(**{
+        'model': Model(estimator=estimator, feature_names=feature_names).compile(),
+        'heroes': heroes,
+        'n_required_teams': 3,
+        'n_generate_solutions': 20,
+        'reduce_probabilities': reduce_grand_arena,
+        'seed': 42,
+        **kwargs,
+    }).initialize()
+
+
+def make_grand_enemy(user_id: str) -> GrandArenaEnemy:
+    random_state = numpy.random.RandomState(int(user_id))
+    user = User(id=user_id, name=user_id, serverId='1', level='1')
+    return GrandArenaEnemy(userId=user_id, place='1', power=0, user=user, heroes=[
+        [Hero(id=str(i), level=random_state.randint(1, 100), star=3, color=4) for i in range(5 * j, 5 * j + 5)]
+        for j in range(3)
+    ])
+
+
+@pytest.mark.parametrize('n_heroes, chunk_size', [(5, 1), (8, 1), (12, 100)])
+def test_yield_all_teams(n_heroes: int, chunk_size: int):
+    hero_features = numpy.random.RandomState(42).randint(0, 100, (n_heroes, 3)).astype(float)
+    defender_features = numpy.array([1.0, 2.0, 3.0])
+    with patch.object(constants, 'ARENA_EXHAUSTIVE_CHUNK_SIZE', chunk_size):
+        chunks = [
+            (x.copy(), teams.copy())  # the arrays get reused
+            for x, teams in ArenaSolver.yield_all_teams(hero_features, defender_features)
+        ]
+    x = numpy.vstack([x for x, _ in chunks])
+    teams = numpy.vstack([teams for _, teams in chunks])
+    assert sorted(map(tuple, teams.tolist())) == list(combinations(range(n_heroes), TEAM_SIZE))
+    numpy.testing.assert_allclose(x, hero_features[teams].sum(axis=1) - defender_features)
+
+
+def test_make_battle_features():
+    random_state = numpy.random.RandomState(42)
+    hero_features = random_state.rand(20, 4)
+    teams = random_state.randint(0, 20, (7, TEAM_SIZE))
+    defender_features = random_state.rand(4)
+    out = numpy.empty((7, 4))
+    x = make_battle_features(hero_features, teams, defender_features, out=out, x_heroes=numpy.empty((7, 4)))
+    assert x is out
+    numpy.testing.assert_array_equal(x, hero_features[teams].sum(axis=1) - defender_features)
+
+
+def test_find_unique_offspring():
+    survivors = numpy.array([
+        [0, 1, 2, 3, 4, 5, 6],
+        [1, 2, 3, 4, 6, 5, 0],
+    ])
+    offspring = numpy.array([
+        [4, 3, 2, 1, 0, 6, 5],  # the same team as the 1st survivor
+        [0, 1, 2, 3, 5, 4, 6],  # new
+        [5, 3, 2, 1, 0, 4, 6],  # the same team as the previous one
+        [6, 1, 2, 3, 4, 0, 5],  # the same team as the 2nd survivor
+        [0, 1, 2, 3, 6, 4, 5],  # new
+    ])
+    out = numpy.empty((7, 1, TEAM_SIZE), dtype=int)
+    assert find_unique_offspring(survivors, offspring, out=out).tolist() == [1, 4]
+
+
+@pytest.mark.parametrize('n_parallel, enemy_time_limit, page_time_limit, expected', [
+    (1, None, None, [None, None, None]),
+    (1, 2.0, None, [2.0, 4.0, 6.0]),
+    (1, None, 3.0, [1.0, 2.0, 3.0]),
+    (1, 2.0, 3.0, [1.0, 2.0, 3.0]),
+    (2, 2.0, None, [2.0, 2.0, 4.0]),
+    (2, None, 3.0, [1.5, 1.5, 3.0]),
+])
+def test_make_deadlines(n_parallel: int, enemy_time_limit: float, page_time_limit: float, expected: list):
+    solver = make_solver(enemy_time_limit=enemy_time_limit, page_time_limit=page_time_limit)
+    with patch('bestmobabot.arena.time', return_value=100.0):
+        deadlines = solver.make_deadlines(3, n_parallel)
+    assert deadlines == [deadline and 100.0 + deadline for deadline in expected]
+    assert solver.make_deadlines(0) == []
+
+
+@pytest.mark.parametrize('n_battles, k', [(1, 1), (3, 1), (3, 2), (3, 3), (5, 3)])
+def test_reduce_at_least(n_battles: int, k: int):
+    ys = numpy.random.RandomState(42).uniform(size=(n_battles, 10))
+    expected = sum(
+        numpy.prod([y if is_won else 1.0 - y for y, is_won in zip(ys, outcome)], axis=0)
+        for outcome in product([False, True], repeat=n_battles)
+        if sum(outcome) >= k
+    )
+    numpy.testing.assert_allclose(reduce_at_least(ys, k=k), expected)
+
+
+def test_reduce_arenas():
+    y1, y2, y3 = ys = numpy.random.RandomState(42).uniform(size=(3, 10))
+    numpy.testing.assert_allclose(reduce_normal_arena(ys[:1]), y1)
+    numpy.testing.assert_allclose(
+        reduce_grand_arena(ys),
+        y1 * y2 * y3 + y1 * y2 * (1.0 - y3) + y2 * y3 * (1.0 - y1) + y1 * y3 * (1.0 - y2),
+    )
+
+
+def test_make_swaps():
+    swaps = make_swaps(12, slices(2, TEAM_SIZE))
+    assert len(swaps) == 5 * 5 + 5 * 2 + 5 * 2
+    assert len({tuple(swap) for swap in swaps.tolist()}) == len(swaps)
+    assert all(i // TEAM_SIZE < j // TEAM_SIZE for i, j in swaps.tolist())
+
+
+def test_swap_heroes():
+    solutions = numpy.arange(12, dtype=numpy.uint8).reshape(3, 4)
+    swap_heroes(solutions, numpy.array([[0, 3], [1, 2], [3, 0]]))
+    numpy.testing.assert_array_equal(solutions, [[3, 1, 2, 0], [4, 6, 5, 7], [11, 9, 10, 8]])
+    assert solutions.dtype == numpy.uint8
+
+
+def test_store_load_solutions():
+    db = {}
+    solver = make_grand_solver(db=db, user_id='1')
+    solver.store_solutions()
+    stored_solutions = db[solver.solutions_key]
+    assert len(stored_solutions) == solver.n_keep_solutions
+
+    # Drop a couple of heroes and get new ones.
+    heroes = [*solver.heroes[2:], Hero(id='20', level=1, star=1, color=1), Hero(id='21', level=1, star=1, color=1)]
+    new_solver = make_grand_solver(db=db, user_id='1', heroes=heroes, n_keep_solutions=solver.n_keep_solutions + 5)
+    assert new_solver.solutions.shape == (new_solver.n_keep_solutions, len(heroes))
+    for solution in new_solver.solutions:
+        assert sorted(solution) == list(range(len(heroes)))
+    for hero_ids, solution in zip(stored_solutions, new_solver.solutions):
+        new_hero_ids = [heroes[i].id for i in solution]
+        assert new_hero_ids[:-2] == [hero_id for hero_id in hero_ids if hero_id not in ('0', '1')]
+        assert sorted(new_hero_ids[-2:]) == ['20', '21']
+
+
+def test_phase_timer():
+    timings = {}
+    timer = PhaseTimer(timings)
+    timer.lap('a')
+    timer.lap('b')
+    timer.lap('a')
+    assert list(timings) == ['a', 'b']
+    assert all(time >= 0.0 for time in timings.values())
+
+
+def test_phase_timer_disabled():
+    PhaseTimer(None).lap('a')  # must not fail
+
+
+def test_team_memo():
+    memo = TeamMemo(max_size=2)
+    memo.update({(0, b'a'): 0.1, (0, b'b'): 0.2})
+    memo.update({(1, b'a'): 0.3})
+    assert len(memo) == 2
+    assert memo.get((0, b'a')) is None  # the oldest item is evicted
+    assert memo.get((0, b'b')) == 0.2
+    assert memo.get((1, b'a')) == 0.3
+    assert (memo.n_hits, memo.n_misses) == (2, 1)
+
+
+def test_solver_stats_add():
+    stats = SolverStats(n_generations=1, n_solutions=2, n_rows=3, timings={'a': 1.0})
+    stats += SolverStats(n_generations=10, n_solutions=20, n_rows=30, timings={'a': 2.0, 'b': 3.0})
+    assert stats == SolverStats(n_generations=11, n_solutions=22, n_rows=33, timings={'a': 3.0, 'b': 3.0})
+
+
+@pytest.mark.parametrize('stats, expected', [
+    (SolverStats(), 0.0),
+    (SolverStats(screening_time=1.0), -1.0),
+    (SolverStats(n_enemies=2, n_skipped=3, time=10.0, screening_time=1.0), 14.0),
+])
+def test_solver_stats_saved_time(stats: SolverStats, expected: float):
+    assert stats.saved_time == pytest.approx(expected)
+
+
+def test_summarize_runs():
+    runs = DataFrame([
+        {'arena': 'normal', 'mode': 'genetic', 'enemy': '1', 'seed': 0, 'time': 1.0, 'n_generations': 10,
+         'n_rows': 100, 'n_timeouts': 0, 'n_best_rows': 50, 'probability': 0.5},
+        {'arena': 'normal', 'mode': 'genetic', 'enemy': '1', 'seed': 1, 'time': 3.0, 'n_generations': 20,
+         'n_rows': 300, 'n_timeouts': 1, 'n_best_rows': 150, 'probability': 0.7},
+        {'arena': 'normal', 'mode': 'genetic', 'enemy': '2', 'seed': 0, 'time': 4.0, 'n_generations': 30,
+         'n_rows': 200, 'n_timeouts': 1, 'n_best_rows': 10, 'probability': 0.9},
+    ])
+    results = summarize_runs(runs).set_index('enemy')
+    assert results.loc['1', 'n_runs'] == 2
+    assert results.loc['1', 'time'] == pytest.approx(2.0)
+    assert results.loc['1', 'n_rows'] == pytest.approx(200.0)
+    assert results.loc['1', 'n_best_rows'] == pytest.approx(100.0)
+    assert results.loc['1', 'rows_per_second'] == pytest.approx(100.0)
+    assert results.loc['1', 'probability_mean'] == pytest.approx(0.6)
+    assert results.loc['1', 'probability_var'] == pytest.approx(0.02)
+    assert results.loc['total', 'n_runs'] == 3
+    assert results.loc['total', 'n_timeouts'] == 2
+    assert results.loc['total', 'n_generations'] == pytest.approx(20.0)
+    assert results.loc['total', 'rows_per_second'] == pytest.approx(75.0)
+
+
+def test_evolve_resumable():
+    enemy = make_grand_enemy('1')
+    expected = make_grand_solver().solve_enemy(enemy)
+
+    solver = make_grand_solver()
+    evolution = solver.start_evolution(enemy, solver.solutions)
+    solver.evolve(evolution, 3)
+    assert not evolution.is_finished
+    solver.evolve(evolution)
+    assert evolution.is_finished
+    assert evolution.solution == expected
+    assert evolution.solution.attackers == expected.attackers
+    assert evolution.stats.n_generations == expected.stats.n_generations
+
+
+def test_solve_page_halving():
+    enemies = [make_grand_enemy(user_id) for user_id in ('1', '2', '3')]
+    solver = make_grand_solver(halving_generations=1)
+    solution = solver.solve_page(enemies)
+    assert solution == max(solver.cache.values())
+    # The dropped enemies are not solved yet, thus they're skipped and would get solved if they show up again.
+    assert solver.stats.n_skipped >= 1
+    assert len(solver.cache) == solver.stats.n_enemies == 3 - solver.stats.n_skipped
+    assert solver.solutions.shape == (solver.n_keep_solutions, len(solver.heroes))
+
+
+def test_screen_enemy():
+    solver = make_grand_solver()
+    solution = solver.screen_enemy(make_grand_enemy('1'))
+    assert len(solution.attackers) == 3
+    assert len({hero.id for team in solution.attackers for hero in team}) == 15
+    assert solution.probability == pytest.approx(reduce_grand_arena(numpy.array(solution.probabilities)))
+    assert solution.stats.n_rows > 0
+
+
+def test_screen_enemies_solves_best():
+    enemies = [make_grand_enemy(user_id) for user_id in ('1', '2', '3')]
+    solver = make_grand_solver(screening_margin=0.0)
+    # The earlier page solution would make all the enemies on this page hopeless.
+    solver.cache['99'] = ArenaSolution(enemy=make_grand_enemy('99'), attackers=[], probability=1.0, probabilities=[])
+    best_screened = max(solver.screen_enemy(enemy) for enemy in enemies)
+    solution = solver.solve_page(enemies)
+    assert solution.enemy.user_id == best_screened.enemy.user_id
+    assert solution.stats.n_generations > 0
+    assert sorted(solver.cache) == sorted(['99', best_screened.enemy.user_id])  # skipped enemies are not cached
+    assert solver.stats.n_skipped == 2
+
+
+def test_solve_enemy_keeps_heuristic_optimum():
+    # The probability grows with the team levels, thus the most powerful heroes make the optimal team.
+    heroes = [Hero(id=str(i), level=i + 1, star=3, color=4, power=i) for i in range(20)]
+    estimator = SimpleNamespace(predict_proba=lambda x: numpy.c_[-x[:, 0], x[:, 0]] / 200.0 + 0.5)
+    solver = make_solver(
+        model=Model(estimator=estimator, feature_names=['total_levels']),
+        heroes=heroes,
+        n_generate_solutions=1,
+        n_generations_count_down=1,
+        seed=42,
+    ).initialize()
+    enemy = ArenaEnemy(userId='1', place='1', power=0, heroes=heroes[:5])
+    screened = solver.screen_enemy(enemy)
+    solution = solver.solve_enemy(enemy)
+    assert sorted(hero.id for hero in solution.attackers[0]) == ['15', '16', '17', '18', '19']
+    assert solution.probability == pytest.approx(screened.probability)
+
+
+def test_solve_page_in_workers():
+    enemies = [make_grand_enemy(user_id) for user_id in ('1', '2', '3')]
+    results = []
+    for n_workers in (1, 2):
+        solver = make_grand_solver(n_workers=n_workers)
+        with solver.start_pool():
+            solution = solver.solve_page(enemies)
+        results.append((solution, solver.cache, solver.solutions))
+    (serial_solution, serial_cache, serial_solutions), (solution, cache, solutions) = results
+    assert solution == serial_solution
+    assert cache == serial_cache
+    numpy.testing.assert_array_equal(solutions, serial_solutions)
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+@pytest.mark.parametrize('max_iterations', [1, 3])
+def test_solve_fetches_only_used_pages(prefetch: bool, max_iterations: int):
+    user_ids = count(1)
+    n_pages = []
+    solver = make_grand_solver(
+        get_enemies=lambda: [make_grand_enemy(str(next(user_ids)))],
+        callback=n_pages.append,
+        prefetch=prefetch,
+        max_iterations=max_iterations,
+        early_stop=2.0,
+    )
+    solver.solve()
+    n_fetched = next(user_ids) - 1
+    assert n_pages == list(range(1, len(n_pages) + 1))
+    assert len(n_pages) <= n_fetched <= max_iterations  # the solver may stop before the prefetched page
+
+
+def test_solve_enemy_on_islands():
+    enemy = make_grand_enemy('1')
+    solver = make_grand_solver(n_islands=3, migration_interval=2)
+    solution = solver.solve_enemy(enemy)
+    assert solution.stats.n_enemies == 1
+    assert solution.stats.n_generations >= 3 * solver.n_generations_count_down
+    assert len(solution.attackers) == 3
+    assert solver.solutions.shape == (solver.n_keep_solutions, len(solver.heroes))
+
+
+def test_solve_page_on_islands_deadlines():
+    enemies = [make_grand_enemy(user_id) for user_id in ('1', '2', '3', '4')]
+    solver = make_grand_solver(n_workers=2, n_islands=2, enemy_time_limit=0.5)
+    with solver.start_pool(), patch.object(solver, 'make_deadlines', wraps=solver.make_deadlines) as make_deadlines:
+        solver.solve_page(enemies)
+    make_deadlines.assert_called_once_with(4, 1)  # islands of an enemy occupy the pool
+
+
+@pytest.mark.parametrize('kwargs', [{'n_islands': 3, 'migration_interval': 2}, {'halving_generations': 1}])
+def test_solve_page_in_workers_counts_rows(kwargs: dict):
+    enemies = [make_grand_enemy(user_id) for user_id in ('1', '2', '3')]
+    results = []
+    for n_workers in (1, 2):
+        solver = make_grand_solver(n_workers=n_workers, **kwargs)
+        with solver.start_pool():
+            solution = solver.solve_page(enemies)
+        results.append((solution, solver.stats.n_rows, solver.stats.n_best_rows))
+    (serial_solution, *serial_rows), (solution, *rows) = results
+    assert solution == serial_solution
+    assert rows == serial_rows  # the workers keep the memos between the rounds
+
+
+def test_migrate():
+    islands = [
+        SimpleNamespace(solutions=numpy.array([[0, 1], [2, 3], [4, 5]]), ys=numpy.array([[0.1, 0.9, 0.5]])),
+        SimpleNamespace(solutions=numpy.array([[6, 7], [8, 9], [10, 11]]), ys=numpy.array([[0.8, 0.3, 0.2]])),
+    ]
+    with patch.object(constants, 'ARENA_N_MIGRANTS', 1):
+        make_solver(n_keep_solutions=3).migrate(islands)
+    numpy.testing.assert_array_equal(islands[0].solutions, [[6, 7], [2, 3], [4, 5]])
+    numpy.testing.assert_array_equal(islands[0].ys, [[0.8, 0.9, 0.5]])
+    numpy.testing.assert_array_equal(islands[1].solutions, [[6, 7], [8, 9], [2, 3]])
+    numpy.testing.assert_array_equal(islands[1].ys, [[0.8, 0.3, 0.9]])
+
+
+@pytest.mark.parametrize('engine', list(ArenaEngine))
+@pytest.mark.parametrize('is_grand, assign_teams', [(False, False), (True, False), (True, True)])
+def test_engines(engine: ArenaEngine, is_grand: bool, assign_teams: bool):
+    enemy = make_grand_enemy('1')
+    if is_grand:
+        solver = make_grand_solver(engine=engine, assign_teams=assign_teams)
+    else:
+        enemy = ArenaEnemy(userId=enemy.user_id, place=enemy.place, power=enemy.power, heroes=enemy.heroes[0])
+        solver = make_grand_solver(engine=engine, n_required_teams=1, reduce_probabilities=reduce_normal_arena)
+    solution = solver.solve_enemy(enemy)
+    assert len(solution.attackers) == len(enemy.teams)
+    assert solution.probability == pytest.approx(solver.reduce_probabilities(numpy.c_[solution.probabilities])[0])
+    assert 0.0 <= solution.probability <= 1.0
+    assert 0 < solution.stats.n_best_rows <= solution.stats.n_rows
+    assert solver.solutions.shape == (solver.n_keep_solutions, len(solver.heroes))
+
+
+def test_predict_assigned_battles():
+    solver = make_grand_solver()
+    enemy = make_grand_enemy('1')
+    hero_features, defenders_features = solver.make_enemy_features(enemy)
+    team_selectors = slices(3, TEAM_SIZE)
+    solutions = numpy.vstack([numpy.random.RandomState(i).permutation(len(solver.heroes)) for i in range(20)])
+
+    # Naively score all the team orders.
+    expected = []
+    for solution in solutions:
+        teams = solution[:3 * TEAM_SIZE].reshape(3, TEAM_SIZE)
+        candidates = numpy.vstack([
+            numpy.concatenate([*teams[list(order)], solution[3 * TEAM_SIZE:]])
+            for order in permutations(range(3))
+        ])
+        ys = numpy.empty((3, len(candidates)))
+        solver.predict_battles(
+            candidates, hero_features, defenders_features, team_selectors, TeamMemo(1000), PhaseTimer(None),
+            out=ys, x=numpy.empty((3 * len(candidates), hero_features.shape[1])),
+            x_heroes=numpy.empty((len(candidates), hero_features.shape[1])),
+        )
+        expected.append(solver.reduce_probabilities(ys).max())
+
+    assigned = solutions.copy()
+    ys = numpy.empty((3, len(solutions)))
+    with patch.object(Model, 'predict_proba', autospec=True, side_effect=Model.predict_proba) as predict_proba:
+        solver.predict_assigned_battles(
+            assigned, hero_features, defenders_features, team_selectors, TeamMemo(1000), PhaseTimer(None),
+            out=ys, x=numpy.empty((9 * len(solutions), hero_features.shape[1])),
+            x_heroes=numpy.empty((3 * len(solutions), hero_features.shape[1])),
+        )
+    predict_proba.assert_called_once()
+    numpy.testing.assert_allclose(solver.reduce_probabilities(ys), expected)
+
+    # The teams get reordered, and the probabilities correspond to the new order.
+    numpy.testing.assert_array_equal(numpy.sort(assigned, axis=1), numpy.sort(solutions, axis=1))
+    numpy.testing.assert_array_equal(assigned[:, 3 * TEAM_SIZE:], solutions[:, 3 * TEAM_SIZE:])
+    actual = numpy.empty((3, len(solutions)))
+    solver.predict_battles(
+        assigned, hero_features, defenders_features, team_selectors, TeamMemo(1000), PhaseTimer(None),
+        out=actual, x=numpy.empty((3 * len(solutions), hero_features.shape[1])),
+        x_heroes=numpy.empty((len(solutions), hero_features.shape[1])),
+    )
+    numpy.testing.assert_allclose(actual, ys)
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from threading import Thread
+
 import pytest
 
 from bestmobabot.database import Database
@@ -33,8 +35,48 @@ def test_set_replace():
     assert db['foo'] == 43
 
 
+def test_delete():
+    db = Database(':memory:')
+    db['foo'] = 42
+    del db['foo']
+    assert 'foo' not in db
+
+
+def test_delete_missing():
+    with pytest.raises(KeyError):
+        del Database(':memory:')['missing_key']
+
+
 def test_get_by_prefix():
     db = Database(':memory:')
     db['foo:qux'] = 42
     db['foo:quux'] = 43
     assert list(db.get_by_prefix('foo')) == [('foo:qux', 42), ('foo:quux', 43)]
+
+
+def test_get_keys_by_prefix():
+    db = Database(':memory:')
+    db['foo:qux'] = 42
+    db['foo:quux'] = 43
+    db['bar:qux'] = 44
+    assert sorted(db.get_keys_by_prefix('foo')) == ['foo:quux', 'foo:qux']
+
+
+def test_set_blob():
+    db = Database(':memory:')
+    db.set_blob('foo', b'\x00\xff')
+    assert db.get_blob('foo') == b'\x00\xff'
+    assert 'foo' not in db
+
+
+def test_get_missing_blob():
+    with pytest.raises(KeyError):
+        Database(':memory:').get_blob('missing_key')
+
+
+def test_set_from_thread():
+    db = Database(':memory:')
+    thread = Thread(target=db.__setitem__, args=('foo', 42))
+    thread.start()
+    thread.join()
+    assert db['foo'] == 42
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from unittest.mock import patch
+
+import numpy
+
+from bestmobabot import constants
+from bestmobabot.dataclasses_ import Hero
+from bestmobabot.features import Vectorizer
+
+HEROES = [
+    Hero(id='1', level=10, star=2, color=3, skills={'100': 10}, runes=[5, 0]),
+    Hero(id='2', level=20, star=3, color=4, slots=['0', '1'], artifacts=[{'level': 7, 'star': 2}]),
+    Hero(id='3', level=30, star=4, color=5),
+]
+FEATURE_NAMES = [
+    'total_levels',
+    'level_1',
+    'level_2',
+    'skill_1_100',
+    'rune_1_0',
+    'slot_2_1',
+    'artifact_level_2_0',
+    'star_3',
+    'unknown',
+]
+
+
+def test_transform():
+    x = Vectorizer(FEATURE_NAMES).transform(HEROES)
+    expected = numpy.array([[hero.features.get(name, 0.0) for name in FEATURE_NAMES] for hero in HEROES])
+    numpy.testing.assert_array_equal(x, expected)
+
+
+def test_transform_empty():
+    assert Vectorizer(FEATURE_NAMES).transform([]).shape == (0, len(FEATURE_NAMES))
+
+
+def test_transform_cached():
+    vectorizer = Vectorizer(FEATURE_NAMES)
+    x = vectorizer.transform(HEROES)
+    assert vectorizer.transform(list(HEROES)) is x
+    assert vectorizer.transform([*HEROES[:2], HEROES[2].copy(update={'level': 31})]) is not x
+
+
+def test_transform_evicts_least_recently_used():
+    vectorizer = Vectorizer(FEATURE_NAMES)
+    with patch.object(constants, 'FEATURES_CACHE_SIZE', 2):
+        x = vectorizer.transform(HEROES[:1])
+        vectorizer.transform(HEROES[1:2])
+        vectorizer.transform(HEROES[:1])
+        vectorizer.transform(HEROES[2:])
+        assert vectorizer.transform(HEROES[:1]) is x
+        assert len(vectorizer.cache) == 2
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import numpy
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from bestmobabot.forest import Forest
+
+
+@pytest.mark.parametrize('n_estimators, max_depth', [
+    (1, 1),
+    (5, None),
+    (20, 3),
+])
+def test_predict_proba(n_estimators: int, max_depth: int):
+    random_state = numpy.random.RandomState(42)
+    x = random_state.normal(size=(500, 10))
+    y = x[:, 0] + x[:, 1] * x[:, 2] + random_state.normal(size=500) > 0.0
+    estimator = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=42).fit(x, y)
+    x_test = random_state.normal(size=(100, 10))
+    numpy.testing.assert_allclose(Forest(estimator).predict_proba(x_test), estimator.predict_proba(x_test)[:, 1])
+
+
+def test_non_binary():
+    estimator = RandomForestClassifier(n_estimators=1).fit([[0.0], [1.0], [2.0]], [0, 1, 2])
+    with pytest.raises(ValueError):
+        Forest(estimator)
+
+
+def test_empty():
+    estimator = RandomForestClassifier(n_estimators=1).fit([[0.0], [1.0]], [False, True])
+    assert Forest(estimator).predict_proba(numpy.zeros((0, 1))).shape == (0,)
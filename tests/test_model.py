@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import pickle
+from base64 import b85encode
+from itertools import count
+from unittest.mock import patch
+
+import numpy
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import KFold
+
+from bestmobabot import constants
+from bestmobabot.database import Database
+from bestmobabot.model import Model, Trainer, TTestSearchCV, load_model, save_model
+
+REPLAYS = {
+    '1': {
+        'start_time': 2.0,
+        'win': True,
+        'attackers': [{'id': '1', 'level': 10, 'star': 2, 'color': 3}],
+        'defenders': [{'id': '2', 'level': 20, 'star': 3, 'color': 4}],
+    },
+    '2': {
+        'start_time': 1.0,
+        'win': False,
+        'attackers': [{'id': '3', 'level': 30, 'star': 4, 'color': 5}],
+        'defenders': [{'id': '1', 'level': 10, 'star': 2, 'color': 3}],
+    },
+}
+
+
+def make_db() -> Database:
+    db = Database(':memory:')
+    for replay_id, replay in REPLAYS.items():
+        db[f'replays:{replay_id}'] = replay
+    return db
+
+
+def test_read_battles_backfills_features():
+    db = make_db()
+    battles = Trainer(db, n_splits=2, n_last_battles=10).read_battles()
+    assert battles == [Trainer.parse_battle(REPLAYS['2']), Trainer.parse_battle(REPLAYS['1'])]
+    assert db[Trainer.get_features_key('1')]['battle'] == Trainer.parse_battle(REPLAYS['1'])
+
+
+def test_read_battles_uses_stored_features():
+    db = make_db()
+    Trainer.save_features(db, '1', REPLAYS['1'])
+    db['replays:1'] = None  # must not be parsed again
+    battles = Trainer(db, n_splits=2, n_last_battles=1).read_battles()
+    assert battles == [Trainer.parse_battle(REPLAYS['1'])]
+
+
+def test_train():
+    db = Database(':memory:')
+    for i in range(8):
+        db[f'replays:{i}'] = {
+            'start_time': float(i),
+            'win': i % 2 == 0,
+            'attackers': [{'id': str(i % 2 + 1), 'level': 10 + i, 'star': 2, 'color': 3}],
+            'defenders': [{'id': '3', 'level': 20, 'star': 3, 'color': 4}],
+        }
+    with patch.object(constants, 'MODEL_PARAM_GRID', {'n_estimators': [2]}):
+        Trainer(db, n_splits=2, n_last_battles=10).train()
+    model = load_model(db)
+    assert model.feature_names == sorted(model.feature_names)
+    assert 'win' not in model.feature_names
+    assert len(model.estimator.feature_importances_) == len(model.feature_names)
+
+
+@pytest.mark.parametrize('param_grid, expected_params', [
+    (
+        {'max_depth': [1, 2], 'n_estimators': [1, 3]},
+        [{'max_depth': 1, 'n_estimators': 1}, {'max_depth': 1, 'n_estimators': 3},
+         {'max_depth': 2, 'n_estimators': 1}, {'max_depth': 2, 'n_estimators': 3}],
+    ),
+    ({'max_depth': [1, 2]}, [{'max_depth': 1}, {'max_depth': 2}]),
+])
+def test_cross_validate(param_grid, expected_params):
+    random_state = numpy.random.RandomState(42)
+    x = random_state.rand(40, 3)
+    y = x[:, 0] > 0.5
+    estimator = RandomForestClassifier(random_state=42)
+    search_cv = TTestSearchCV(estimator, param_grid, cv=KFold(4), scoring='accuracy', alpha=1.0)  # no elimination
+    results = list(search_cv.cross_validate(x, y))
+    assert [params for params, _ in results] == expected_params
+    assert all(scores.shape == (4,) for _, scores in results)
+
+
+def test_cross_validate_prefix():
+    random_state = numpy.random.RandomState(42)
+    x = random_state.rand(40, 3)
+    y = x[:, 0] > 0.5
+    estimator = RandomForestClassifier(random_state=42)
+    search_cv = TTestSearchCV(estimator, {'n_estimators': [2, 5]}, cv=KFold(4), scoring='accuracy')
+    (_, scores_2), (_, scores_5) = search_cv.cross_validate(x, y)
+
+    # Fixed random state makes the smaller forest the exact prefix of the bigger one.
+    for scores, n_estimators in [(scores_2, 2), (scores_5, 5)]:
+        expected = [
+            estimator.set_params(n_estimators=n_estimators).fit(x[train], y[train]).score(x[test], y[test])
+            for train, test in KFold(4).split(x, y)
+        ]
+        numpy.testing.assert_array_equal(scores, expected)
+
+
+def test_cross_validate_in_workers():
+    random_state = numpy.random.RandomState(42)
+    x = random_state.rand(40, 3)
+    y = x[:, 0] > 0.5
+    results = []
+    for n_workers in [1, 2]:
+        numpy.random.seed(42)
+        search_cv = TTestSearchCV(
+            RandomForestClassifier(), {'n_estimators': [1, 3]}, cv=KFold(4), scoring='accuracy', n_workers=n_workers)
+        results.append(list(search_cv.cross_validate(x, y)))
+    for (params_1, scores_1), (params_2, scores_2) in zip(*results):
+        assert params_1 == params_2
+        numpy.testing.assert_array_equal(scores_1, scores_2)
+
+
+def test_search_hyper_parameters_interrupted():
+    random_state = numpy.random.RandomState(42)
+    x = random_state.rand(40, 3)
+    y = x[:, 0] > 0.5
+    score_fold = TTestSearchCV.score_fold
+    calls = count()
+
+    def interrupt_third_fold(*args):
+        if next(calls) == 2:
+            raise KeyboardInterrupt
+        return score_fold(*args)
+
+    # The first group gets yielded before the second one is scored.
+    with patch.object(TTestSearchCV, 'score_fold', autospec=True, side_effect=interrupt_third_fold):
+        params = Trainer.search_hyper_parameters(
+            x, y, RandomForestClassifier(random_state=42), {'max_depth': [1, 2]}, KFold(2))
+    assert params == {'max_depth': 1}
+
+
+def test_search_hyper_parameters_interrupted_empty():
+    x = numpy.random.RandomState(42).rand(40, 3)
+    with patch.object(TTestSearchCV, 'score_fold', side_effect=KeyboardInterrupt):
+        with pytest.raises(KeyboardInterrupt):
+            Trainer.search_hyper_parameters(x, x[:, 0] > 0.5, RandomForestClassifier(), {'max_depth': [1]}, KFold(2))
+
+
+def test_eliminate():
+    search_cv = TTestSearchCV(RandomForestClassifier(), {}, cv=KFold(4), scoring='accuracy')
+    candidates = [{'n_estimators': 1}, {'n_estimators': 2}, {'n_estimators': 3}]
+    scores = [[0.5, 0.51, 0.49], [0.9, 0.91, 0.89], [0.88, 0.92, 0.9]]
+    is_alive = numpy.array([True, True, True])
+    search_cv.eliminate(candidates, scores, is_alive)
+    assert is_alive.tolist() == [False, True, True]
+
+
+def make_model() -> Model:
+    x = numpy.array([[0.0, 1.0], [1.0, 0.0], [0.0, 2.0], [2.0, 0.0]])
+    y = numpy.array([False, True, False, True])
+    return Model(RandomForestClassifier(n_estimators=3, random_state=42).fit(x, y), ['foo', 'bar'])
+
+
+def test_load_model():
+    db = Database(':memory:')
+    save_model(db, make_model())
+    model = load_model(db)
+    assert model.feature_names == ['foo', 'bar']
+    assert model.forest is None
+    assert load_model(db) is model
+
+
+def test_load_model_compile_forest():
+    db = Database(':memory:')
+    save_model(db, make_model())
+    model = load_model(db)
+    compiled_model = load_model(db, compile_forest=True)
+    assert compiled_model.forest is not None
+    assert compiled_model is not model
+    assert load_model(db, compile_forest=True) is compiled_model
+
+
+def test_load_model_reloads_new_version():
+    db = Database(':memory:')
+    save_model(db, make_model())
+    model = load_model(db)
+    save_model(db, make_model())
+    assert load_model(db) is not model
+
+
+def test_load_legacy_model():
+    db = Database(':memory:')
+    db['bot:model'] = b85encode(pickle.dumps(make_model())).decode()
+    model = load_model(db)
+    assert model.feature_names == ['foo', 'bar']
+    assert model.vectorizer is not None
+
+
+def test_save_model_deletes_legacy_model():
+    db = Database(':memory:')
+    db['bot:model'] = b85encode(pickle.dumps(make_model())).decode()
+    save_model(db, make_model())
+    assert 'bot:model' not in db
+    assert load_model(db).feature_names == ['foo', 'bar']
+
+
+def test_load_missing_model():
+    with pytest.raises(KeyError):
+        load_model(Database(':memory:'))